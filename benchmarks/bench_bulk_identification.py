@@ -0,0 +1,82 @@
+"""
+Compare one identification call per path against bulk identification, using the local stand-in server.
+
+Runs offline (no Media Identifier API, database or OTEL collector needed).
+Also checks the fallback: a server without the bulk endpoint makes identify_many return None.
+
+Usage:
+    python -m benchmarks.bench_bulk_identification [paths] [latency_ms] [chunk_size]
+"""
+import os
+import sys
+import time
+
+# The client logs through OTEL; nothing needs to be listening for the benchmark to run.
+os.environ.setdefault("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4317")
+
+from benchmarks.stand_in_identifier_server import StandInIdentifierServer
+from src.data.media_identifier_client import MediaIdentifierClient
+
+
+def _build_paths(count):
+    paths = []
+    for index in range(count):
+        if index % 3 == 0:
+            paths.append(f"/watch/Some.Movie.{index}.{1990 + index % 30}.1080p.BluRay.mkv")
+        else:
+            paths.append(f"/watch/Some.Show.{index // 24}/Some.Show.S01E{index % 24 + 1:02d}.720p.WEB.mkv")
+    return paths
+
+
+def _per_item(client, paths, chunk_size):
+    return {path: client.get(params={"it": path}).status_code for path in paths}
+
+
+def _bulk(client, paths, chunk_size):
+    results = {}
+    for start in range(0, len(paths), chunk_size):
+        chunk_results = client.identify_many(paths[start:start + chunk_size])
+        if chunk_results is None:
+            raise RuntimeError("The stand-in server should support bulk requests")
+        results.update(chunk_results)
+    return results
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 48
+    latency_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 40
+    chunk_size = int(sys.argv[3]) if len(sys.argv) > 3 else 25
+    paths = _build_paths(count)
+
+    server = StandInIdentifierServer(latency_ms=latency_ms).start()
+    try:
+        client = MediaIdentifierClient(base_url=server.url)
+        print(f"{count} paths, {latency_ms} ms per round-trip, bulk chunks of {chunk_size}")
+
+        for name, runner in [("per-item", _per_item), ("bulk", _bulk)]:
+            server.reset_counters()
+            start = time.perf_counter()
+            results = runner(client, paths, chunk_size)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{name:>9}: {elapsed:7.3f}s, {server.requests:4d} round-trips, "
+                f"{len(results)} results -> {count / elapsed * 60:9.1f} paths/min"
+            )
+
+        client.close()
+    finally:
+        server.stop()
+
+    server = StandInIdentifierServer(latency_ms=0, bulk_supported=False).start()
+    try:
+        client = MediaIdentifierClient(base_url=server.url)
+        fallback = client.identify_many(paths[:2]) is None and client.identify_many(paths[:2]) is None
+        print(f" fallback: server without bulk -> identify_many returns None: {fallback}, "
+              f"bulk requests sent: {server.requests} (asked once, then remembered)")
+        client.close()
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Compare how long claiming a batch takes as the backlog grows: the old claim (one UPDATE, then one
+INSERT into batch_control per claimed item) against the set-based claim used by get_next_batch.
+
+Needs a Postgres server (POSTGRES_* environment variables, like the app). The claims run in a
+scratch schema (smo_bench_claim) that is dropped at the end; no rows of the app's tables are
+read or changed (importing the app's modules still creates its tables, if missing).
+
+Usage:
+    python -m benchmarks.bench_claim_batch [backlog sizes, e.g.: 100,1000,5000,20000]
+
+Measured with the default sizes, against a local PostgreSQL 16.2:
+     backlog |   row by row |    set-based | speed-up
+         100 |        7.5ms |        2.2ms |     3.4x
+        1000 |       58.9ms |       15.5ms |     3.8x
+        5000 |      239.9ms |       90.6ms |     2.6x
+       20000 |     1087.1ms |      295.2ms |     3.7x
+"""
+import os
+import sys
+import time
+import uuid
+
+import psycopg2
+
+# The app's modules log through OTEL; nothing needs to be listening for the benchmark to run.
+os.environ.setdefault("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4317")
+
+from src.data.base_repository import _db_connection_params
+from src.data.work_queue_manager import _claim_batch_query
+
+_schema = "smo_bench_claim"
+
+_returned_columns = "id, full_path, filename, parent, target_path, status, is_archive, is_main_archive_file, created_at, modified_at, media_info_cache_id, source_sha256"
+
+
+def _create_tables(cursor):
+    cursor.execute(f"DROP SCHEMA IF EXISTS {_schema} CASCADE;")
+    cursor.execute(f"CREATE SCHEMA {_schema};")
+    cursor.execute(f"SET search_path TO {_schema}, public;")
+    cursor.execute("""CREATE TABLE work_queue (
+                          id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+                          full_path TEXT NOT NULL,
+                          filename TEXT NOT NULL,
+                          parent TEXT NOT NULL,
+                          target_path TEXT NULL,
+                          status TEXT NOT NULL,
+                          is_archive BOOLEAN NOT NULL DEFAULT FALSE,
+                          is_main_archive_file BOOLEAN NOT NULL DEFAULT FALSE,
+                          created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                          modified_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                          media_info_cache_id UUID NULL,
+                          source_sha256 TEXT NULL,
+                          leased_by TEXT NULL,
+                          lease_expires_at TIMESTAMPTZ NULL,
+                          attempts INTEGER NOT NULL DEFAULT 0,
+                          last_error TEXT NULL,
+                          next_attempt_at TIMESTAMPTZ NULL,
+                          file_size BIGINT NULL,
+                          file_mtime_ns BIGINT NULL);""")
+    cursor.execute("""CREATE TABLE batch_control (
+                          batch_id UUID NOT NULL,
+                          work_queue_id UUID NOT NULL,
+                          in_progress BOOLEAN NOT NULL DEFAULT FALSE,
+                          verified BOOLEAN NOT NULL DEFAULT FALSE,
+                          created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                          modified_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP);""")
+
+
+def _fill_backlog(cursor, size):
+    cursor.execute("TRUNCATE work_queue, batch_control;")
+    cursor.execute(
+        """INSERT INTO work_queue (full_path, filename, parent, status, created_at)
+           SELECT '/watch/file-' || n || '.mkv', 'file-' || n || '.mkv', '/watch', 'PENDING',
+                  CURRENT_TIMESTAMP - (n * INTERVAL '1 millisecond')
+           FROM generate_series(1, %s) AS n;""",
+        (size,),
+    )
+    cursor.execute("ANALYZE work_queue;")
+
+
+def _claim_row_by_row(cursor, limit):
+    cursor.execute(
+        f"""UPDATE work_queue
+            SET status = 'WORKING', modified_at = CURRENT_TIMESTAMP
+            WHERE id IN (SELECT id FROM work_queue WHERE status = 'PENDING' ORDER BY created_at LIMIT %s)
+            RETURNING {_returned_columns}""",
+        (limit,),
+    )
+    rows = cursor.fetchall()
+    batch_id = str(uuid.uuid4())
+    for row in rows:
+        cursor.execute(
+            "INSERT INTO batch_control (batch_id, work_queue_id, in_progress) VALUES (%s, %s, true)",
+            (batch_id, row[0]),
+        )
+    return rows
+
+
+def _claim_set_based(cursor, limit):
+    cursor.execute(_claim_batch_query, ("bench", 120, limit, str(uuid.uuid4())))
+    return cursor.fetchall()
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1].split(",")] if len(sys.argv) > 1 else [100, 1000, 5000, 20000]
+    conn = psycopg2.connect(**_db_connection_params)
+
+    try:
+        with conn.cursor() as cursor:
+            _create_tables(cursor)
+            conn.commit()
+
+            print(f"{'backlog':>8} | {'row by row':>12} | {'set-based':>12} | speed-up")
+            for size in sizes:
+                timings = {}
+                for name, claim in [("row_by_row", _claim_row_by_row), ("set_based", _claim_set_based)]:
+                    _fill_backlog(cursor, size)
+                    conn.commit()
+
+                    start = time.perf_counter()
+                    rows = claim(cursor, None)
+                    conn.commit()
+                    timings[name] = time.perf_counter() - start
+
+                    cursor.execute("SELECT COUNT(*) FROM batch_control;")
+                    registered = cursor.fetchone()[0]
+                    if len(rows) != size or registered != size:
+                        raise RuntimeError(f"{name}: claimed {len(rows)} and registered {registered} of {size} items")
+
+                print(
+                    f"{size:>8} | {timings['row_by_row'] * 1000:>10.1f}ms | {timings['set_based'] * 1000:>10.1f}ms | "
+                    f"{timings['row_by_row'] / timings['set_based']:7.1f}x"
+                )
+    finally:
+        conn.rollback()
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {_schema} CASCADE;")
+        conn.commit()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Compare the file classification engine (src/tasks/classify_file.py) against the checks it replaced
+(is_compressed_file + is_main_archive_file + check_should_copy_file, reproduced below by path only),
+over a generated corpus of scene release file paths: episodes and movies, samples (in the name, or in
+a Sample folder), subtitles and .nfo/.sfv files, old (.rar/.r00...) and new (.partNN.rar) style RAR
+sets, split 7z/zip, tarballs.
+
+Runs offline; only names are classified (no file is read, no stat).
+
+Usage:
+    python -m benchmarks.bench_classify_file [names]
+"""
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+from src.tasks.classify_file import classify_filename
+
+_legacy_compressed_extensions = (
+    '.zip', '.rar', '.7z',
+    '.gz', '.gzip', '.tgz', '.tar.gz', '.tar.gzip',
+    '.bz2', '.bzip2', '.tbz', '.tbz2', '.tar.bz2',
+    '.xz', '.txz', '.tar.xz',
+    '.lz', '.lzma', '.lzop',
+    '.Z', '.z',
+)
+_legacy_multipart_patterns = (
+    re.compile(r'\.part\d+\.rar$', re.IGNORECASE),
+    re.compile(r'\.r\d{2,}$', re.IGNORECASE),
+    re.compile(r'\.z\d{2,}$', re.IGNORECASE),
+    re.compile(r'\.7z\.\d{3,}$', re.IGNORECASE),
+)
+_legacy_formats = [
+    ([r"\.rar$"], [r"\.r\d{2,}$", r"\.part\d+\.rar$"]),
+    ([r"\.zip$"], [r"\.z\d{2,}$", r"\.zip\.\d{3,}$", r"\.part\d+\.zip$"]),
+    ([r"\.7z$"], [r"\.7z\.\d{3,}$", r"\.part\d+\.7z$"]),
+    ([r"\.tar$"], [r"\.tar\.\d{3,}$", r"\.part\d+\.tar$"]),
+    ([r"\.tar\.gz$", r"\.tgz$"], [r"\.tar\.gz\.\d{3,}$", r"\.tgz\.\d{3,}$", r"\.part\d+\.tar\.gz$", r"\.part\d+\.tgz$"]),
+    ([r"\.tar\.bz2$", r"\.tbz2$"], [r"\.tar\.bz2\.\d{3,}$", r"\.tbz2\.\d{3,}$", r"\.part\d+\.tar\.bz2$", r"\.part\d+\.tbz2$"]),
+    ([r"\.tar\.xz$", r"\.txz$"], [r"\.tar\.xz\.\d{3,}$", r"\.txz\.\d{3,}$", r"\.part\d+\.tar\.xz$", r"\.part\d+\.txz$"]),
+    ([r"\.gz$"], [r"\.gz\.\d{3,}$", r"\.part\d+\.gz$"]),
+    ([r"\.bz2$"], [r"\.bz2\.\d{3,}$", r"\.part\d+\.bz2$"]),
+    ([r"\.xz$"], [r"\.xz\.\d{3,}$", r"\.part\d+\.xz$"]),
+]
+_legacy_extensions_to_skip = [
+    "sh", "bat", "ps1", "py", "js", "rb", "pl", "php", "lua",
+    "exe", "dll", "bin", "so", "out",
+]
+
+_titles = [
+    "The.Expanse", "Severance", "Dark", "Breaking.Bad", "The.Bear", "Shogun", "Andor", "Fargo",
+    "Blade.Runner.2049", "Dune.Part.Two", "Oppenheimer", "Arrival", "Heat", "Alien", "The.Thing", "Sicario",
+]
+_qualities = ["720p", "1080p", "2160p"]
+_sources = ["WEB-DL.DDP5.1.H.264", "BluRay.x264", "WEBRip.x265.10bit", "HDTV.x264", "BluRay.REMUX.AVC.DTS-HD.MA.5.1"]
+_groups = ["NTb", "FLUX", "SPARKS", "GECKOS", "KOGi", "RARBG", "EDITH", "playWEB"]
+
+
+def _release_name(rng):
+    title = rng.choice(_titles)
+    if rng.random() < 0.6:
+        episode = f"S{rng.randint(1, 9):02d}E{rng.randint(1, 24):02d}"
+    else:
+        episode = str(rng.randint(1970, 2025))
+    return f"{title}.{episode}.{rng.choice(_qualities)}.{rng.choice(_sources)}-{rng.choice(_groups)}"
+
+
+def _file_names(rng, release):
+    roll = rng.random()
+    if roll < 0.35:
+        return [f"{release}.mkv"]
+    if roll < 0.45:
+        return [f"{release}.mkv", f"{release}.sample.mkv", f"{release}.nfo", f"{release}.srt"]
+    if roll < 0.50:
+        # Samples in their own folder, with an obfuscated name: only the path says it's a sample.
+        return [f"{release}.mkv", f"Sample/{rng.choice(_groups).lower()}-{rng.randint(100, 999)}.mkv"]
+    if roll < 0.70:
+        volumes = rng.randint(5, 60)
+        return [f"{release}.rar", f"{release}.sfv"] + [f"{release}.r{index:02d}" for index in range(volumes)]
+    if roll < 0.85:
+        return [f"{release}.part{index:02d}.rar" for index in range(1, rng.randint(5, 40))]
+    if roll < 0.92:
+        return [f"{release}.7z.{index:03d}" for index in range(1, rng.randint(3, 15))]
+    if roll < 0.97:
+        return [f"{release}.{rng.choice(['zip', 'tar.gz', 'tgz', 'tar.xz', '7z'])}"]
+    return [f"{release}.{rng.choice(['exe', 'sh', 'txt', 'jpg', 'mp4', 'avi'])}"]
+
+
+def _build_corpus(size):
+    rng = random.Random(42)
+    names = []
+    while len(names) < size:
+        release = _release_name(rng)
+        names.extend(f"/watch/{release}/{name}" for name in _file_names(rng, release))
+    return names[:size]
+
+
+def _legacy_status(filename):
+    """The previous queue_worker classification, by name only."""
+    lower = Path(filename).name.lower()
+
+    is_archive = lower.endswith(_legacy_compressed_extensions) or any(pattern.search(lower) for pattern in _legacy_multipart_patterns)
+
+    main_archive_file = False
+    if is_archive:
+        for main_patterns, multi_patterns in _legacy_formats:
+            if any(re.search(pattern, lower) for pattern in multi_patterns):
+                break
+            if any(re.search(pattern, lower) for pattern in main_patterns):
+                main_archive_file = True
+                break
+
+    should_copy_file = "sample" not in filename.lower() and Path(filename).suffix.lower().replace(".", "") not in _legacy_extensions_to_skip
+
+    return "IGNORED" if (is_archive and not main_archive_file) or not should_copy_file else "PENDING"
+
+
+def _time(call, names):
+    start = time.perf_counter()
+    results = [call(name) for name in names]
+    return time.perf_counter() - start, results
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    names = _build_corpus(size)
+
+    legacy_seconds, legacy_statuses = _time(_legacy_status, names)
+    engine_seconds, classifications = _time(classify_filename, names)
+
+    differences = {}
+    for name, legacy_status, classification in zip(names, legacy_statuses, classifications):
+        if legacy_status != classification.status:
+            suffix = "".join(Path(name).suffixes[-2:])
+            differences[suffix] = differences.get(suffix, 0) + 1
+
+    print(f"{size} file names")
+    print(f"{'':>8} | {'total':>9} | {'per name':>9}")
+    print(f"{'legacy':>8} | {legacy_seconds:8.2f}s | {legacy_seconds / size * 1e6:7.2f}us")
+    print(f"{'engine':>8} | {engine_seconds:8.2f}s | {engine_seconds / size * 1e6:7.2f}us")
+    print(f"speed-up: {legacy_seconds / engine_seconds:.1f}x")
+    print(f"different status: {sum(differences.values())} {differences}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Compare the serial batch loop against the parallel execution mode (stage pipeline).
+
+The stages are simulated so this runs offline (no database, API or OTEL collector needed):
+- identify: sleeps for a fixed latency, like a call to the Media Identifier API;
+- decompress: hashes an in-memory buffer, to keep one core busy;
+- copy: copies a real file inside a temporary folder.
+
+Usage:
+    python -m benchmarks.bench_parallel_batch [items] [copy_size_mb]
+"""
+import hashlib
+import shutil
+import sys
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+
+from src.stage_pipeline import Stage, StagePipeline, IDENTIFY_STAGE, DECOMPRESS_STAGE, COPY_STAGE
+
+_identify_latency_seconds = 0.15
+_decompress_buffer = b"\0" * (32 * 1024 * 1024)
+_archive_every = 4
+
+
+def _identify(index):
+    time.sleep(_identify_latency_seconds)
+    return (DECOMPRESS_STAGE if index % _archive_every == 0 else COPY_STAGE), index
+
+
+def _decompress(index):
+    hashlib.sha256(_decompress_buffer).hexdigest()
+    return None, None
+
+
+def _copy(source_file, work_dir, index):
+    shutil.copyfile(source_file, work_dir.joinpath(f"item-{index}.bin"))
+    return None, None
+
+
+def _run_serial(items, source_file, work_dir, limits):
+    handlers = {
+        IDENTIFY_STAGE: _identify,
+        DECOMPRESS_STAGE: _decompress,
+        COPY_STAGE: partial(_copy, source_file, work_dir),
+    }
+    for index in range(items):
+        stage_name, value = IDENTIFY_STAGE, index
+        while stage_name is not None:
+            stage_name, value = handlers[stage_name](value)
+
+    return []
+
+
+def _run_parallel(items, source_file, work_dir, limits):
+    pipeline = StagePipeline(
+        [
+            Stage(IDENTIFY_STAGE, _identify, limits[IDENTIFY_STAGE], 8),
+            Stage(DECOMPRESS_STAGE, _decompress, limits[DECOMPRESS_STAGE], 8),
+            Stage(COPY_STAGE, partial(_copy, source_file, work_dir), limits[COPY_STAGE], 8),
+        ],
+        on_error=lambda index, error: print(f"Item {index} failed: {error}"),
+    )
+    pipeline.start()
+    for index in range(items):
+        pipeline.submit(IDENTIFY_STAGE, index)
+    pipeline.join()
+
+    return pipeline.stats()
+
+
+def main():
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    copy_size_mb = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    limits = {IDENTIFY_STAGE: 4, DECOMPRESS_STAGE: 2, COPY_STAGE: 2}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_dir = Path(tmp)
+        source_file = tmp_dir.joinpath("source.bin")
+        with source_file.open("wb") as fh:
+            fh.write(b"\1" * (copy_size_mb * 1024 * 1024))
+
+        print(f"{items} items, {copy_size_mb} MB per copy, limits: {limits}")
+        for name, runner in [("serial", _run_serial), ("parallel", _run_parallel)]:
+            work_dir = tmp_dir.joinpath(name)
+            work_dir.mkdir()
+
+            start = time.perf_counter()
+            stage_stats = runner(items, source_file, work_dir, limits)
+            elapsed = time.perf_counter() - start
+
+            print(f"{name:>8}: {elapsed:7.2f}s -> {items / elapsed * 60:8.1f} items/min")
+            for stats in stage_stats:
+                print(f"          {stats}")
+            shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Compare the hot queries of the work queue and the activity log sent as plain SQL text (parsed and
+planned by Postgres on every call) against the same queries as server-side prepared statements.
+
+Needs a Postgres server (POSTGRES_* environment variables, like the app). The queries run in a
+scratch schema (smo_bench_prepared, created by the app's migrations) that is dropped at the end;
+no rows of the app's tables are read or changed (importing the app's modules still creates its
+tables, if missing).
+
+Usage:
+    python -m benchmarks.bench_prepared_statements [iterations] [backlog size]
+
+Measured with `2000 5000`, against a local PostgreSQL 16.2 (mean / p95, microseconds per call):
+                     query |              text |          prepared | speed-up
+           count due items |   190.0 /   255.1 |   164.4 /   250.0 |    1.16x
+               claim batch |  1393.5 /  1812.1 |  1387.6 /  1741.2 |    1.00x
+           get batch items |   398.8 /   570.5 |   296.0 /   370.2 |    1.35x
+          update work item |   299.5 /   466.8 |   204.9 /   264.1 |    1.46x
+       activity insert x20 |   844.5 /  1108.5 |   845.8 /  1190.4 |    1.00x
+"""
+import logging
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+# The app's modules log through OTEL; nothing needs to be listening for the benchmark to run.
+os.environ.setdefault("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4317")
+
+import src.data.prepared_statements as prepared_statements
+from src.data.activity_logger import _insert_activity_records
+from src.data.base_repository import _db_connection_params
+from src.data.migrations import apply_migrations
+from src.data.work_queue_manager import (
+    WorkQueueManager, _claim_batch, _count_due_items, _get_batch_items, _update_item, _update_item_columns,
+)
+
+_schema = "smo_bench_prepared"
+_batch_size = 10
+_activity_records_per_write = 20
+
+
+def _create_schema(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP SCHEMA IF EXISTS {_schema} CASCADE;")
+        cursor.execute(f"CREATE SCHEMA {_schema};")
+        cursor.execute(f"SET search_path TO {_schema}, public;")
+    conn.commit()
+    apply_migrations(conn, logging.getLogger("bench_prepared_statements"))
+
+
+def _fill_backlog(cursor, size):
+    cursor.execute(
+        """INSERT INTO work_queue (full_path, filename, parent, status, created_at)
+           SELECT '/watch/file-' || n || '.mkv', 'file-' || n || '.mkv', '/watch', 'PENDING',
+                  CURRENT_TIMESTAMP - (n * INTERVAL '1 millisecond')
+           FROM generate_series(1, %s) AS n;""",
+        (size,),
+    )
+    cursor.execute("ANALYZE work_queue;")
+
+
+def _run(conn, cursor, iterations, call, after=None):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        call()
+        conn.commit()
+        timings.append(time.perf_counter() - start)
+        if after is not None:
+            after()
+            conn.commit()
+    return timings
+
+
+def _build_cases(cursor, batch_id, work_item):
+    def unclaim():
+        cursor.execute("UPDATE work_queue SET status = 'PENDING', attempts = 0 WHERE status = 'WORKING';")
+        cursor.execute("DELETE FROM batch_control WHERE batch_id <> %s;", (batch_id,))
+
+    update_params = [work_item[column] for column in _update_item_columns] + [work_item["id"]]
+    now = datetime.now(timezone.utc)
+    records = [(now, "INFO", "Bench", f"activity record {index}") for index in range(_activity_records_per_write)]
+    columns = [list(column) for column in zip(*records)]
+
+    return [
+        ("count due items",
+         lambda: cursor.execute(_count_due_items.query, (10, 50)),
+         lambda: _count_due_items.execute(cursor, (10, 50)),
+         None),
+        ("claim batch",
+         lambda: cursor.execute(_claim_batch.query, ("bench", 120, _batch_size, str(uuid.uuid4()))),
+         lambda: _claim_batch.execute(cursor, ("bench", 120, _batch_size, str(uuid.uuid4()))),
+         unclaim),
+        ("get batch items",
+         lambda: cursor.execute(_get_batch_items.query, (batch_id,)),
+         lambda: _get_batch_items.execute(cursor, (batch_id,)),
+         None),
+        ("update work item",
+         lambda: cursor.execute(_update_item.query, update_params),
+         lambda: _update_item.execute(cursor, update_params),
+         None),
+        # The text variant is what the activity writer used before: execute_values into VALUES.
+        (f"activity insert x{_activity_records_per_write}",
+         lambda: execute_values(
+             cursor,
+             "INSERT INTO activity_tracker (created_at, level, source_logger, activity) VALUES %s",
+             records,
+             page_size=len(records),
+         ),
+         lambda: _insert_activity_records.execute(cursor, columns),
+         None),
+    ]
+
+
+def _describe(timings):
+    ordered = sorted(timings)
+    return statistics.mean(ordered) * 1e6, ordered[int(len(ordered) * 0.95) - 1] * 1e6
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    backlog = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    prepared_statements._prepared_statements_enabled = True
+    conn = psycopg2.connect(**_db_connection_params)
+
+    try:
+        _create_schema(conn)
+        with conn.cursor() as cursor:
+            _fill_backlog(cursor, backlog)
+            batch_id = str(uuid.uuid4())
+            _claim_batch.execute(cursor, ("bench", 120, 50, batch_id))
+            rows = cursor.fetchall()
+            conn.commit()
+            work_item = WorkQueueManager._parse_work_item_row_to_object(rows[0])
+
+            print(f"{iterations} calls each, {backlog} items in the backlog (mean / p95, microseconds per call)")
+            print(f"{'query':>22} | {'text':>17} | {'prepared':>17} | speed-up")
+            for name, text_call, prepared_call, after in _build_cases(cursor, batch_id, work_item):
+                # Warm up both (and prepare the statement), so only the steady state is measured.
+                for call in (text_call, prepared_call):
+                    call()
+                    conn.commit()
+                    if after is not None:
+                        after()
+                        conn.commit()
+
+                text_mean, text_p95 = _describe(_run(conn, cursor, iterations, text_call, after))
+                prepared_mean, prepared_p95 = _describe(_run(conn, cursor, iterations, prepared_call, after))
+                print(
+                    f"{name:>22} | {text_mean:7.1f} / {text_p95:7.1f} | {prepared_mean:7.1f} / {prepared_p95:7.1f} | "
+                    f"{text_mean / prepared_mean:7.2f}x"
+                )
+    finally:
+        conn.rollback()
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {_schema} CASCADE;")
+        conn.commit()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Local stand-in for the Media Identifier API, to run benchmarks (and the app) offline.
+
+- GET /?it=<path>: identifies one path. 204 when the name contains "unknown".
+- POST /bulk with {"items": [paths]}: identifies many paths, answering {"results": [...]}
+  in the same order (null where the single call would answer 204).
+
+Every request waits for a fixed latency (the round-trip: network, TLS, API overhead),
+plus a small cost per identified path.
+
+Usage:
+    python -m benchmarks.stand_in_identifier_server [--port 8085] [--latency-ms 40] [--no-bulk]
+"""
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import PurePath
+from urllib.parse import parse_qs, urlparse
+
+_episode_marker = re.compile(r"[sS](\d{1,2})[eE](\d{1,3})")
+_year_marker = re.compile(r"\b(19\d{2}|20\d{2})\b")
+
+
+def fake_identify(full_path: str):
+    """Build a plausible media info from the file name, like the real API would."""
+    name = PurePath(full_path).stem
+    if "unknown" in name.lower():
+        return None
+
+    words = re.split(r"[\s._\-]+", name)
+    episode = _episode_marker.search(name)
+    if episode is not None:
+        title_words = words[:next(i for i, word in enumerate(words) if _episode_marker.match(word))]
+        return {
+            "id": str(uuid.uuid5(uuid.NAMESPACE_URL, full_path)),
+            "media_type": "tv",
+            "title": " ".join(title_words) or name,
+            "season": int(episode.group(1)),
+            "episode": int(episode.group(2)),
+        }
+
+    year = _year_marker.search(name)
+    title_words = words[:words.index(year.group(1))] if year is not None else words
+    return {
+        "id": str(uuid.uuid5(uuid.NAMESPACE_URL, full_path)),
+        "media_type": "movie",
+        "title": " ".join(title_words) or name,
+        "year": int(year.group(1)) if year is not None else None,
+    }
+
+
+class StandInIdentifierServer:
+    def __init__(self, port: int = 0, latency_ms: float = 40, per_item_ms: float = 1, bulk_supported: bool = True):
+        self.latency_seconds = latency_ms / 1000
+        self.per_item_seconds = per_item_ms / 1000
+        self.bulk_supported = bulk_supported
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._build_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stand-in-identifier", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+
+    def _count_request(self, items: int):
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.latency_seconds + self.per_item_seconds * items)
+
+    def _build_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                full_path = parse_qs(urlparse(self.path).query).get("it", [""])[0]
+                server._count_request(1)
+                media_info = fake_identify(full_path)
+                if media_info is None:
+                    self._send(204)
+                    return
+                self._send(200, media_info)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not server.bulk_supported or urlparse(self.path).path.rstrip("/") != "/bulk":
+                    server._count_request(0)
+                    self._send(404, {"error": "not found"})
+                    return
+
+                items = json.loads(body or b"{}").get("items", [])
+                server._count_request(len(items))
+                self._send(200, {"results": [fake_identify(item) for item in items]})
+
+            def _send(self, status_code, payload=None):
+                data = b"" if payload is None else json.dumps(payload).encode("utf-8")
+                self.send_response(status_code)
+                if payload is not None:
+                    self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8085)
+    parser.add_argument("--latency-ms", type=float, default=40)
+    parser.add_argument("--no-bulk", action="store_true", help="Answer 404 to bulk requests.")
+    args = parser.parse_args()
+
+    server = StandInIdentifierServer(args.port, args.latency_ms, bulk_supported=not args.no_bulk).start()
+    print(f"Stand-in identifier listening on {server.url} (bulk: {not args.no_bulk}). CTRL+C to stop.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 from dotenv import load_dotenv
 load_dotenv()
 
+import signal
 import threading
 import os
 import time
@@ -13,6 +14,7 @@ from src.batch_processor import batch_processor
 from src.queue_worker import add_to_queue, queue_consumer
 from src.data.work_queue_manager import WorkQueueManager
 from src.notification_receiver import handle_notification_messages
+from src.tasks.check_for_file_stability import stability_registry
 from src.utils import flush_all_otel_loggers
 
 _work_queue_manager = WorkQueueManager()
@@ -23,8 +25,21 @@ class MyHandler(FileSystemEventHandler):
     def on_created(self, event):
         add_to_queue(event.src_path, event.is_directory)
 
+    def on_modified(self, event):
+        if not event.is_directory:
+            stability_registry.record_modified(event.src_path)
+
+    def on_closed(self, event):
+        # Only fired when a file opened for writing is closed (inotify IN_CLOSE_WRITE).
+        if not event.is_directory:
+            stability_registry.record_closed(event.src_path)
+
 
 def main():
+    # Stop the same way on SIGTERM (docker stop) as on CTRL+C, so the shutdown hooks
+    # (like the flush of the buffered activity records) get to run.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
     monitored_path = os.environ.get('WATCH_FOLDER')
     event_handler = MyHandler()
     observer = Observer()
@@ -5,11 +5,12 @@ import os
 import sys
 from pathlib import Path
 
-from src.batch_processor import process_batch
+from src.batch_processor import run_batch
 from src.data.activity_logger import ActivityTracker
 from src.data.notification_repository import NotificationRepository
 from src.data.work_queue_manager import WorkQueueManager
-from src.queue_worker import prepare_file_for_processing
+from src.queue_worker import prepare_files_for_processing
+from src.tasks.identify_file import invalidate_identification
 from src.utils import flush_all_otel_loggers
 
 _work_queue_manager = WorkQueueManager()
@@ -20,11 +21,19 @@ _notification_agent = NotificationRepository(client_id="smo-watchdog-notificatio
 _activity_tracker = ActivityTracker("On Demand")
 
 
-def on_demand_batch():
+def on_demand_batch(retry_now=False):
     tag = "[BATCH]"
 
-    _activity_tracker.info(f"{tag} Moving files back to PENDING.")
-    _work_queue_manager.move_working_items_back_to_pending(batch_id=None)
+    if retry_now:
+        _activity_tracker.info(f"{tag} Resetting the attempts of the files waiting for a retry or out of attempts.")
+        reset = _work_queue_manager.reset_attempts()
+        _activity_tracker.info(f"{tag} {reset} files can be claimed right away again.")
+
+    # Items other workers are still working on keep their lease; only abandoned ones go back to PENDING.
+    _activity_tracker.info(f"{tag} Moving files with an expired lease back to PENDING.")
+    released = _work_queue_manager.release_expired_leases()
+    _activity_tracker.info(f"{tag} {released} files moved back to PENDING.")
+    _work_queue_manager.start_lease_heartbeat()
 
     _activity_tracker.info(f"{tag} Forcing a new batch to be processed.")
     batch, batch_id = _work_queue_manager.get_next_batch(force_new_batch=True)
@@ -67,7 +76,7 @@ def on_demand_batch():
 
     _activity_tracker.info(f"{tag} Processing batch with id [{batch_id}]...")
 
-    process_batch(batch, batch_id)
+    run_batch(batch, batch_id)
 
 
 def on_demand_process_missing_add():
@@ -99,17 +108,29 @@ def on_demand_process_missing_add():
     _activity_tracker.info(f"{tag} Found {diff} new files to add to the queue.")
 
     new_files = [f[0] for f in files_found if f[1] not in existing_filenames]
-    for new_file in new_files:
-        _activity_tracker.debug(f"{tag} Adding new file to the queue: {new_file}")
-        prepare_file_for_processing(new_file)
+    prepare_files_for_processing(new_files)
 
     on_demand_batch()
 
 
+def on_demand_invalidate_identification(full_path=None):
+    tag = "[INVALIDATE]"
+
+    if full_path is None:
+        _activity_tracker.info(f"{tag} Clearing the whole identification cache.")
+    else:
+        _activity_tracker.info(f"{tag} Clearing the cached identification for: {full_path}")
+
+    deleted = invalidate_identification(full_path)
+    _activity_tracker.info(f"{tag} {deleted} cached identifications removed.")
+
+
 def print_usage():
-    print("Usage: python on_demand.py [batch|missing]")
-    print("  batch: creates a new batch, and process all pending/working files.")
+    print("Usage: python on_demand.py [batch [--retry]|missing|invalidate [path]]")
+    print("  batch: creates a new batch, and process all pending files (and working files whose worker is gone).")
+    print("    --retry: also files waiting for a retry and files out of attempts (FAILED_MAX_ATTEMPTS), with their attempts reset.")
     print("  missing: reads the IN folder and adds the missing files to the queue, and processes them.")
+    print("  invalidate: clears the identification cache for the given file, or all of it.")
 
 
 def main():
@@ -124,9 +145,11 @@ def main():
     command = sys.argv[1].strip()
 
     if command == "batch":
-        on_demand_batch()
+        on_demand_batch(retry_now="--retry" in sys.argv[2:])
     elif command == "missing":
         on_demand_process_missing_add()
+    elif command == "invalidate":
+        on_demand_invalidate_identification(sys.argv[2] if len(sys.argv) > 2 else None)
     else:
         print("Invalid command.\n")
         print_usage()
@@ -1,25 +1,44 @@
+import contextvars
+import math
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 
 from opentelemetry import trace
 
 from src.data.activity_logger import ActivityTracker
 from src.data.notification_repository import NotificationRepository
-from src.tasks.check_for_file_stability import check_is_file_stable
+from src.tasks.check_for_file_stability import check_is_file_stable, iter_stable_files
 from src.tasks.copy_file import copy_file
 from src.tasks.decompress_file import decompress_file
-from src.tasks.identify_file import identify_file
+from src.tasks.identify_file import identify_file, prefetch_identifications
 from src.tasks.sanitize_string_for_filename import sanitize_string_for_filename
 from src.data.work_queue_manager import WorkQueueManager
+from src.stage_pipeline import (
+    Stage, StagePipeline, StageStats, get_stage_limits_from_env, get_stage_queue_size_from_env,
+    STABILITY_STAGE, IDENTIFY_STAGE, DECOMPRESS_STAGE, COPY_STAGE,
+)
 from src.tasks.verify_batch_data import verify_batch_data
-from src.utils import release_idle_memory
+from src.utils import get_file_fingerprint, release_idle_memory, to_int
 
 _work_queue_manager = WorkQueueManager()
 _movies_base_folder = os.environ.get('MOVIES_BASE_FOLDER')
 _series_base_folder = os.environ.get('SERIES_BASE_FOLDER')
 _activity_tracker = ActivityTracker("Batch Processor")
 _notification_agent = NotificationRepository(client_id="smo-watchdog-notification-sender")
+_batch_execution_mode = (os.environ.get('BATCH_EXECUTION_MODE') or 'serial').strip().lower()
+_stage_limits = get_stage_limits_from_env()
+_stage_queue_size = get_stage_queue_size_from_env()
+_wakeup_safety_net_seconds = to_int(os.environ.get('BATCH_WAKEUP_TIMEOUT_SECONDS'), 300)
+_max_batch_size = max(1, to_int(os.environ.get('BATCH_MAX_SIZE'), 50))
+_max_batch_age_seconds = max(0, to_int(os.environ.get('BATCH_MAX_AGE_SECONDS'), 10))
+_max_concurrent_batches = max(1, to_int(os.environ.get('BATCH_MAX_CONCURRENT'), 2))
+
+# Unit of work of the batch being processed. Stage workers inherit it with the submitter's context.
+_current_unit_of_work = contextvars.ContextVar("current_unit_of_work", default=None)
 
 if _series_base_folder is None or _movies_base_folder is None:
     _activity_tracker.error("No base folders defined. Exiting...")
@@ -28,32 +47,77 @@ if _series_base_folder is None or _movies_base_folder is None:
 
 def batch_processor():
     tag = "[BATCH PROCESSOR]"
-    current_batch_id = None
-    idle_cycles = 0
-    while True:
-        batch, current_batch_id = _work_queue_manager.get_next_batch(
-            batch_id=current_batch_id
-        )
+    woken_up = False
+    batch_slots = threading.BoundedSemaphore(_max_concurrent_batches)
+    executor = ThreadPoolExecutor(max_workers=_max_concurrent_batches, thread_name_prefix="smo-batch")
+    _work_queue_manager.start_listening()
+    _work_queue_manager.start_lease_heartbeat()
 
-        if batch is not None and len(batch) > 0:
-            idle_cycles = 0
-            _activity_tracker.info(
-                f"{tag} NEW BATCH FOUND! Working on [{current_batch_id}]!"
+    while True:
+        # Rolling micro-batches: a new batch can start while earlier ones are still running.
+        batch_slots.acquire()
+        try:
+            batch, batch_id = _work_queue_manager.get_next_batch(
+                max_batch_size=_max_batch_size,
+                max_batch_age_seconds=_max_batch_age_seconds,
             )
+        except Exception:
+            batch_slots.release()
+            raise
 
-            process_batch(batch, current_batch_id)
-
+        if batch is not None and len(batch) > 0:
             _activity_tracker.info(
-                f"{tag} BATCH PROCESSING DONE! Batch id: {current_batch_id}..."
+                f"{tag} NEW BATCH FOUND! Working on [{batch_id}] with {len(batch)} items!"
             )
-            current_batch_id = None
+            executor.submit(_run_batch, batch, batch_id, batch_slots)
+            # There may be more work queued already.
+            continue
+
+        batch_slots.release()
+
+        # Woken up, but nothing was due yet: check again once the pending items are old enough.
+        timeout = _max_batch_age_seconds if woken_up else _wakeup_safety_net_seconds
+        # Items released into a backoff send no notification: check again when the first one is due.
+        next_retry_seconds = _work_queue_manager.seconds_until_next_retry()
+        if next_retry_seconds is not None:
+            timeout = min(timeout, math.ceil(next_retry_seconds))
+        woken_up = _work_queue_manager.wait_for_work(max(timeout, 1))
+        if not woken_up:
             release_idle_memory()
-        else:
-            idle_cycles += 1
-            if idle_cycles % 6 == 0:  # ~every 60s of idle polling
-                release_idle_memory()
 
-        time.sleep(10)
+
+def _run_batch(batch, batch_id, batch_slots):
+    tag = "[BATCH PROCESSOR]"
+    try:
+        run_batch(batch, batch_id)
+        _activity_tracker.info(
+            f"{tag} BATCH PROCESSING DONE! Batch id: {batch_id}..."
+        )
+    except Exception as e:
+        _activity_tracker.error(f"{tag} Error processing batch [{batch_id}]: {str(e)}")
+    finally:
+        batch_slots.release()
+        release_idle_memory()
+
+
+def run_batch(batch, batch_id):
+    """
+    Process a claimed batch, keeping its leases alive while it runs. If processing fails before
+    the batch releases its WORKING items, they are released here, so they are retried (or given
+    up on) instead of staying WORKING, leased to this worker.
+    """
+    _work_queue_manager.add_active_batch(batch_id)
+    try:
+        process_batch(batch, batch_id)
+    except Exception:
+        try:
+            _work_queue_manager.move_working_items_back_to_pending(batch_id)
+        except Exception as e:
+            # Not renewed anymore: they are released once their lease expires.
+            _activity_tracker.error(f"[B.ID: {batch_id}] Could not release the items of the failed batch: {str(e)}")
+        raise
+    finally:
+        _work_queue_manager.remove_active_batch(batch_id)
 
 
 @_activity_tracker.trace("process_batch")
@@ -66,33 +130,32 @@ def process_batch(batch, current_batch_id):
         })
 
     tag = f"[B.ID: {current_batch_id}]"
-    try_again = []
 
-    # First try.
-    for item in batch:
-        try:
-            file_to_retry = _process_batch_item(item)
-            if file_to_retry is not None:
-                try_again.append(file_to_retry)
-                continue
-        except Exception as e:
-            _activity_tracker.error(f"{tag} Error processing item [{item['id']}]: {str(e)}")
-            item['status'] = 'FAILED_PROCESSING'
-            _work_queue_manager.update(item)
+    try:
+        # One bulk round-trip for the whole batch, instead of one call per item.
+        prefetch_identifications([item['full_path'] for item in batch])
+    except Exception as e:
+        _activity_tracker.warning(f"{tag} Could not prefetch the identifications, items will be identified one at a time: {str(e)}")
 
-    if len(try_again) > 0:
-        _activity_tracker.debug(f"{tag} Retrying to process {len(try_again)} items...")
+    # Changes to the items are written together: when an item is done, or at the end of the batch.
+    unit_of_work = _work_queue_manager.unit_of_work()
+    unit_of_work.track(batch)
+    token = _current_unit_of_work.set(unit_of_work)
+    try:
+        # First try.
+        try_again = _process_items(batch, tag, 'FAILED_PROCESSING')
 
-    # Retry.
-    for item in try_again:
-        try:
-            _process_batch_item(item)
-        except Exception as e:
-            _activity_tracker.error(f"{tag} Error retrying to process item [{item['id']}]: {str(e)}")
-            item['status'] = 'FAILED_PROCESSING_RETRY'
-            _work_queue_manager.update(item)
+        if len(try_again) > 0:
+            _activity_tracker.debug(f"{tag} Retrying to process {len(try_again)} items...")
+
+        # Retry.
+        _process_items(try_again, tag, 'FAILED_PROCESSING_RETRY')
+    finally:
+        # Must happen before moving WORKING items back to PENDING, or finished items would be moved too.
+        unit_of_work.flush()
+        _current_unit_of_work.reset(token)
 
-    _activity_tracker.debug(f"{tag} In case any 'WORKING' items slipped through, we're going to move them back to pending so the next batch will take care of them.")
+    _activity_tracker.debug(f"{tag} In case any 'WORKING' items slipped through, we're going to move them back to pending so a later batch will take care of them (or give up on them, once they are out of attempts).")
     _work_queue_manager.move_working_items_back_to_pending(current_batch_id)
     _work_queue_manager.set_batch_as_done(current_batch_id)
 
@@ -112,69 +175,185 @@ def process_batch(batch, current_batch_id):
         _activity_tracker.error(f"{tag} Error sending batch completion notification: {str(e)}")
 
 
+def _process_items(items, tag, failed_status):
+    """Process the items as they become stable, returning the ones that should be retried."""
+    if _batch_execution_mode == 'parallel':
+        return _process_items_in_parallel(items, tag, failed_status)
+
+    try_again = []
+    for item, is_file_stable in iter_stable_files(items, _get_item_full_path):
+        file_to_retry = _try_process_batch_item(item, is_file_stable, tag, failed_status)
+        if file_to_retry is not None:
+            try_again.append(file_to_retry)
+
+    return try_again
+
+
+def _process_items_in_parallel(items, tag, failed_status):
+    span = trace.get_current_span()
+    _activity_tracker.debug(f"{tag} Processing {len(items)} items through the stage pipeline.")
+
+    pipeline = StagePipeline(
+        [
+            Stage(name, _stage_handlers[name], _stage_limits[name], _stage_queue_size)
+            for name in (IDENTIFY_STAGE, DECOMPRESS_STAGE, COPY_STAGE)
+        ],
+        on_error=partial(_handle_batch_item_error, tag=tag, failed_status=failed_status),
+    )
+    stability_stats = StageStats(STABILITY_STAGE)
+    try_again = []
+
+    pipeline.start()
+    try:
+        last_yield = time.monotonic()
+        for item, is_file_stable in iter_stable_files(items, _get_item_full_path):
+            stability_stats.record(time.monotonic() - last_yield, failed=not is_file_stable)
+
+            if not is_file_stable:
+                _activity_tracker.warning(f"{tag} File is not stable. Will try again later. File: {item['full_path']}")
+                item['last_error'] = "File is not stable"
+                _save_item(item)
+                try_again.append(item)
+            else:
+                pipeline.submit(IDENTIFY_STAGE, item)
+
+            last_yield = time.monotonic()
+    finally:
+        try_again.extend(pipeline.join())
+
+    stage_stats = [stability_stats.snapshot()] + pipeline.stats()
+    for stats in stage_stats:
+        _activity_tracker.debug(f"{tag} Stage stats: {stats}")
+        if span.is_recording():
+            span.set_attributes({
+                f"pipeline.{stats['stage']}.processed": stats["processed"],
+                f"pipeline.{stats['stage']}.items_per_minute": stats["items_per_minute"],
+                f"pipeline.{stats['stage']}.max_queue_depth": stats["max_queue_depth"],
+            })
+
+    return try_again
+
+
+def _try_process_batch_item(item, is_file_stable, tag, failed_status):
+    try:
+        return _process_batch_item(item, is_file_stable)
+    except Exception as e:
+        return _handle_batch_item_error(item, e, tag, failed_status)
+
+
+def _handle_batch_item_error(item, error, tag, failed_status):
+    _activity_tracker.error(f"{tag} Error processing item [{item['id']}] ({failed_status}): {str(error)}")
+    item['status'] = failed_status
+    item['last_error'] = str(error)
+    _save_item(item)
+    return None
+
+
+def _save_item(item, durable=False):
+    """Record the item's changes in the batch's unit of work. `durable` writes them (and anything pending) right away."""
+    unit_of_work = _current_unit_of_work.get()
+    if unit_of_work is None:
+        _work_queue_manager.update(item)
+        return
+
+    unit_of_work.update(item, durable)
+
+
+def _record_fingerprint(item):
+    """Keep the fingerprint of the file as processed, so detecting it again doesn't queue it again."""
+    file_size, file_mtime_ns = get_file_fingerprint(item['full_path'])
+    if file_size is not None:
+        item['file_size'] = file_size
+        item['file_mtime_ns'] = file_mtime_ns
+
+
+def _get_item_full_path(item):
+    return item['full_path']
+
+
 @_activity_tracker.trace("_process_batch_item")
-def _process_batch_item(item):
+def _process_batch_item(item, is_file_stable=None):
     span = trace.get_current_span()
     item_id = item['id']
     full_path = item['full_path']
-    full_path_obj = Path(full_path)
     tag = f"[I.ID: {item_id}]"
 
     if span.is_recording():
         span.set_attributes({
             "work_item.id": str(item_id),
             "file.path": full_path,
-            "file.name": full_path_obj.name,
+            "file.name": Path(full_path).name,
         })
 
-    _activity_tracker.debug(f"{tag} Processing item {full_path}. Checking if file is stable...")
-    is_file_stable = check_is_file_stable(full_path)
+    if is_file_stable is None:
+        _activity_tracker.debug(f"{tag} Processing item {full_path}. Checking if file is stable...")
+        is_file_stable = check_is_file_stable(full_path)
+    else:
+        _activity_tracker.debug(f"{tag} Processing item {full_path}. Stability already checked: {is_file_stable}")
 
     if not is_file_stable:
         _activity_tracker.warning(f"{tag} File is not stable. Will try again later. File: {full_path}")
+        item['last_error'] = "File is not stable"
+        _save_item(item)
         return item
 
+    # Same stages the pipeline runs, just back-to-back on the current thread.
+    stage_name, value = IDENTIFY_STAGE, item
+    while stage_name is not None:
+        stage_name, value = _stage_handlers[stage_name](value)
+
+    return value
+
+
+@_activity_tracker.trace("_identify_batch_item")
+def _identify_batch_item(item):
+    """Identify the item and resolve its destination. Returns the next stage for it, if any."""
+    span = trace.get_current_span()
+    item_id = item['id']
+    full_path = item['full_path']
+    tag = f"[I.ID: {item_id}]"
+
+    if span.is_recording():
+        span.set_attributes({
+            "work_item.id": str(item_id),
+            "file.path": full_path,
+        })
+
     media_info = identify_file(full_path)
 
     if media_info is None:
         item['status'] = 'FAILED_ID'
-        _work_queue_manager.update(item)
-        return None
+        _save_item(item)
+        return None, None
 
     if item['is_archive']:
-        decompress_result = decompress_file(full_path)
-        if not decompress_result:
-            return item
-
-        item['status'] = 'DONE'
-        _work_queue_manager.update(item)
-        return None
+        return DECOMPRESS_STAGE, item
 
     media_info_id = media_info.get('id')
 
     if media_info_id is None:
         _activity_tracker.error(f"{tag} File has no media info id. No way to proceed with it. Media Info cache id: {media_info_id}")
         item['status'] = 'FAILED_ID'
-        _work_queue_manager.update(item)
+        _save_item(item)
 
     item['media_info_cache_id'] = media_info_id
-    _work_queue_manager.update(item)
+    _save_item(item)
 
     media_type = media_info.get('media_type')
 
     if media_type is None or media_type not in ['movie', 'tv']:
         _activity_tracker.error(f"{tag} File has no media type. No way to proceed with it. Media Info cache id: {media_info_id}")
         item['status'] = 'FAILED_ID'
-        _work_queue_manager.update(item)
-        return None
+        _save_item(item)
+        return None, None
 
     title = media_info.get('title')
 
     if title is None:
         _activity_tracker.error(f"{tag} File has no title. No way to proceed with it. Media Info cache id: {media_info_id}")
         item['status'] = 'FAILED_ID'
-        _work_queue_manager.update(item)
-        return None
+        _save_item(item)
+        return None, None
 
     title_as_filename = sanitize_string_for_filename(title)
 
@@ -191,24 +370,59 @@ def _process_batch_item(item):
         if season_number is None:
             _activity_tracker.error(f"{tag} File has no season number. No way to proceed with it. Media Info cache id: {media_info_id}")
             item['status'] = 'FAILED_ID'
-            _work_queue_manager.update(item)
-            return None
+            _save_item(item)
+            return None, None
 
         destination_path = series_base_path.joinpath(title_as_filename).joinpath(f"Season{season_number:02d}")
 
     destination_path.mkdir(parents=True, exist_ok=True)
 
     item['target_path'] = str(destination_path.absolute())
-    _work_queue_manager.update(item)
+    _save_item(item)
 
-    copy_result = copy_file(full_path, destination_path)
+    return COPY_STAGE, item
 
-    if copy_result:
+
+@_activity_tracker.trace("_decompress_batch_item")
+def _decompress_batch_item(item):
+    """Extract the archive in place. Returns the item as a result when it should be retried."""
+    decompress_result = decompress_file(item['full_path'])
+    if not decompress_result:
+        item['last_error'] = "Could not decompress the archive"
+        _save_item(item)
+        return None, item
+
+    _record_fingerprint(item)
+    item['status'] = 'DONE'
+    _save_item(item, durable=True)
+    return None, None
+
+
+@_activity_tracker.trace("_copy_batch_item")
+def _copy_batch_item(item):
+    """Copy the file to the destination resolved by the identify stage."""
+    tag = f"[I.ID: {item['id']}]"
+    file_name = Path(item['full_path']).name
+
+    copied, source_sha256 = copy_file(item['full_path'], Path(item['target_path']))
+
+    if copied:
+        item['source_sha256'] = source_sha256
+        _record_fingerprint(item)
         item['status'] = 'DONE'
-        _work_queue_manager.update(item)
-        _activity_tracker.info(f"{tag} All done with [{full_path_obj.name}]! \\o/")
-        return None
+        _save_item(item, durable=True)
+        _activity_tracker.info(f"{tag} All done with [{file_name}]! \\o/")
+        return None, None
 
-    _activity_tracker.warning(f"{tag} Failed to copy file [{full_path_obj.name}]. Will try again later.")
+    _activity_tracker.warning(f"{tag} Failed to copy file [{file_name}]. Will try again later.")
+    item['last_error'] = f"Could not copy the file to [{item['target_path']}]"
+    _save_item(item)
 
-    return None
+    return None, None
+
+
+_stage_handlers = {
+    IDENTIFY_STAGE: _identify_batch_item,
+    DECOMPRESS_STAGE: _decompress_batch_item,
+    COPY_STAGE: _copy_batch_item,
+}
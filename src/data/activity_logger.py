@@ -1,7 +1,17 @@
+import atexit
+import os
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
 import psycopg2
 from opentelemetry import trace
 
 from src.data.base_repository import BaseRepository
+from src.data.prepared_statements import PreparedStatement
+from src.utils import to_int
 
 _log_levels = {
     "NOTSET": 0,
@@ -12,9 +22,348 @@ _log_levels = {
     "CRITICAL": 50
 }
 
+_overflow_policies = {"drop_oldest", "drop_newest", "block"}
+_partition_intervals = {"day", "month"}
+_partition_bound = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+# One array per column: the same statement (prepared once per connection) writes any number of records.
+_insert_activity_records = PreparedStatement(
+    "smo_insert_activity_records",
+    ("timestamptz[]", "text[]", "text[]", "text[]"),
+    """INSERT INTO activity_tracker (created_at, level, source_logger, activity)
+       SELECT * FROM unnest(%s, %s, %s, %s)""",
+)
+
+
+def _next_period_start(start: datetime, interval: str) -> datetime:
+    if interval == "day":
+        return start + timedelta(days=1)
+
+    return start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+
+
+def _parse_partition_bound(value: str):
+    value = value.strip()
+    if value == "MINVALUE":
+        return datetime.min
+    if value == "MAXVALUE":
+        return datetime.max
+
+    return datetime.fromisoformat(value.strip("'"))
+
+
+class _ActivityPartitions(BaseRepository):
+    """
+    Keeps activity_tracker partitioned by range of created_at (one partition per day or month).
+
+    The partitioned table and its DEFAULT partition come from the schema migrations. Here:
+    - Creates the partitions for the current and the next `ACTIVITY_PARTITIONS_AHEAD` periods,
+      on startup and then periodically. Anything outside them lands in the DEFAULT partition,
+      so an insert never fails because maintenance is late.
+    - Retention: drops the partitions that ended more than `ACTIVITY_RETENTION_DAYS` ago,
+      instead of running DELETE on a huge table.
+
+    Maintenance holds an advisory lock, so several processes (e.g.: main.py and on_demand.py)
+    can run it at the same time.
+    """
+
+    def __init__(self):
+        super().__init__("Activity Partitions")
+        interval = (os.environ.get("ACTIVITY_PARTITION_INTERVAL") or "day").strip().lower()
+        self._interval = interval if interval in _partition_intervals else "day"
+        self._partitions_ahead = max(1, to_int(os.environ.get("ACTIVITY_PARTITIONS_AHEAD"), 3))
+        self._retention_days = max(0, to_int(os.environ.get("ACTIVITY_RETENTION_DAYS"), 30))
+        if interval != self._interval:
+            self._logger.warning(f"Unknown ACTIVITY_PARTITION_INTERVAL [{interval}], using day.")
+
+        # The table itself comes from the migrations; the partitions for today and the next days are made here.
+        self.maintain()
+
+    def maintain(self):
+        """Create the upcoming partitions and drop the expired ones."""
+        tracer = trace.get_tracer(__name__)
+        with tracer.start_as_current_span("ActivityPartitions.maintain") as span:
+            try:
+                with self._get_connection() as conn:
+                    with conn.cursor() as cursor:
+                        cursor.execute("SELECT pg_try_advisory_xact_lock(hashtext('activity_tracker'));")
+                        if not cursor.fetchone()[0]:
+                            # Someone else is on it.
+                            conn.rollback()
+                            return
+
+                        created = self._create_partitions(cursor)
+                        dropped = self._drop_expired_partitions(cursor)
+                        conn.commit()
+            except psycopg2.Error as e:
+                self._logger.error(f"Error maintaining the activity tracker partitions: {str(e)}")
+                return
+
+            if span.is_recording():
+                span.set_attributes({
+                    "db.table": "activity_tracker",
+                    "activity.partitions_created": created,
+                    "activity.partitions_dropped": dropped,
+                })
+
+    def _get_partitions(self, cursor):
+        """Returns [(name, from, to)] of the range partitions (not the DEFAULT one)."""
+        cursor.execute("""SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+                          FROM pg_inherits i
+                          JOIN pg_class c ON c.oid = i.inhrelid
+                          WHERE i.inhparent = 'activity_tracker'::regclass""")
+        partitions = []
+        for name, bound in cursor.fetchall():
+            match = _partition_bound.search(bound or "")
+            if match is None:
+                continue
+            partitions.append((name, _parse_partition_bound(match.group(1)), _parse_partition_bound(match.group(2))))
+        return partitions
+
+    def _create_partitions(self, cursor) -> int:
+        cursor.execute("SELECT date_trunc(%s, LOCALTIMESTAMP);", (self._interval,))
+        start = cursor.fetchone()[0]
+        existing = self._get_partitions(cursor)
+        name_format = "%Y%m%d" if self._interval == "day" else "%Y%m"
+        created = 0
+
+        for _ in range(self._partitions_ahead + 1):
+            end = _next_period_start(start, self._interval)
+            overlaps = any(lower < end and start < upper for _, lower, upper in existing)
+            if not overlaps:
+                self._create_partition(cursor, f"activity_tracker_p{start.strftime(name_format)}", start, end)
+                created += 1
+            start = end
+
+        return created
+
+    def _create_partition(self, cursor, name, start, end):
+        self._logger.debug(f"Creating activity_tracker partition {name} [{start}, {end})")
+        cursor.execute(
+            "SELECT EXISTS (SELECT 1 FROM activity_tracker_default WHERE created_at >= %s AND created_at < %s);",
+            (start, end),
+        )
+        if not cursor.fetchone()[0]:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF activity_tracker FOR VALUES FROM (%s) TO (%s);",
+                (start, end),
+            )
+            return
+
+        # Rows for this period landed in the DEFAULT partition: move them, or the new partition can't be attached.
+        cursor.execute(f"CREATE TABLE {name} (LIKE activity_tracker INCLUDING DEFAULTS);")
+        cursor.execute(
+            f"""WITH moved AS (
+                    DELETE FROM activity_tracker_default
+                    WHERE created_at >= %s AND created_at < %s
+                    RETURNING id, created_at, activity, level, source_logger)
+                INSERT INTO {name} (id, created_at, activity, level, source_logger)
+                SELECT id, created_at, activity, level, source_logger FROM moved;""",
+            (start, end),
+        )
+        cursor.execute(
+            f"ALTER TABLE activity_tracker ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s);",
+            (start, end),
+        )
+
+    def _drop_expired_partitions(self, cursor) -> int:
+        if self._retention_days == 0:
+            return 0
+
+        cursor.execute("SELECT LOCALTIMESTAMP - make_interval(days => %s);", (self._retention_days,))
+        cutoff = cursor.fetchone()[0]
+        dropped = 0
+
+        for name, _, upper in self._get_partitions(cursor):
+            if upper <= cutoff:
+                self._logger.info(f"Dropping activity_tracker partition {name} (retention: {self._retention_days} days)")
+                cursor.execute(f"DROP TABLE {name};")
+                dropped += 1
+
+        return dropped
+
+
+class _ActivityWriter(BaseRepository):
+    """
+    Background writer for the activity_tracker table, shared by every ActivityTracker.
+
+    Records go into a bounded in-memory buffer and are written with multi-row INSERTs,
+    when `ACTIVITY_FLUSH_BATCH_SIZE` records are waiting or every `ACTIVITY_FLUSH_INTERVAL_MS`,
+    whichever comes first. When the buffer is full, `ACTIVITY_BUFFER_OVERFLOW` decides:
+    - drop_oldest (default): make room by dropping the oldest record;
+    - drop_newest: drop the record being logged;
+    - block: wait up to `ACTIVITY_BUFFER_BLOCK_MS` for room, then drop the record being logged.
+    Whatever is still buffered is written on shutdown (atexit).
+    """
+
+    def __init__(self):
+        super().__init__("Activity Writer")
+        self._buffer_size = max(1, to_int(os.environ.get("ACTIVITY_BUFFER_SIZE"), 10000))
+        self._batch_size = max(1, to_int(os.environ.get("ACTIVITY_FLUSH_BATCH_SIZE"), 500))
+        self._flush_interval_seconds = max(1, to_int(os.environ.get("ACTIVITY_FLUSH_INTERVAL_MS"), 1000)) / 1000
+        self._block_seconds = max(0, to_int(os.environ.get("ACTIVITY_BUFFER_BLOCK_MS"), 1000)) / 1000
+        self._shutdown_timeout_seconds = max(1, to_int(os.environ.get("ACTIVITY_SHUTDOWN_TIMEOUT_SECONDS"), 10))
+        self._overflow_policy = (os.environ.get("ACTIVITY_BUFFER_OVERFLOW") or "drop_oldest").strip().lower()
+        if self._overflow_policy not in _overflow_policies:
+            self._logger.warning(f"Unknown ACTIVITY_BUFFER_OVERFLOW [{self._overflow_policy}], using drop_oldest.")
+            self._overflow_policy = "drop_oldest"
+
+        self._maintenance_interval_seconds = max(60, to_int(os.environ.get("ACTIVITY_MAINTENANCE_INTERVAL_SECONDS"), 3600))
+        self._next_maintenance = time.monotonic() + self._maintenance_interval_seconds
+        self._buffer = deque()
+        self._condition = threading.Condition()
+        # flush() asks for a write by bumping _flush_requested; the writer sets _flushed to the last
+        # request it took records for, once they are written.
+        self._flush_requested = 0
+        self._flushed = 0
+        self._dropped = 0
+        self._closed = False
+        self._thread = None
+        atexit.register(self.close)
+
+    def enqueue(self, created_at, level, source_logger, activity):
+        record = (created_at, level, source_logger, activity)
+        with self._condition:
+            if self._closed:
+                # Logged during shutdown, after the last flush: write it right away.
+                self._write([record])
+                return
+
+            if len(self._buffer) >= self._buffer_size and not self._make_room():
+                self._dropped += 1
+                return
+
+            self._buffer.append(record)
+            self._ensure_thread_started()
+
+            if len(self._buffer) >= self._batch_size:
+                self._condition.notify_all()
+
+    def flush(self, timeout_seconds=None):
+        """Wait until everything buffered so far was written. Returns False on timeout."""
+        deadline = time.monotonic() + (timeout_seconds if timeout_seconds is not None else self._shutdown_timeout_seconds)
+        with self._condition:
+            if self._thread is None or self._closed:
+                return len(self._buffer) == 0
+
+            self._flush_requested += 1
+            request = self._flush_requested
+            self._condition.notify_all()
+            return self._condition.wait_for(lambda: self._flushed >= request, timeout=max(0, deadline - time.monotonic()))
+
+    def close(self):
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+            thread = self._thread
+
+        if thread is not None:
+            thread.join(self._shutdown_timeout_seconds)
+            if thread.is_alive():
+                self._logger.error("Activity writer did not finish in time. Some activity records were not saved.")
+                return
+
+        # Never started, or left something behind: write it from here.
+        with self._condition:
+            records = list(self._buffer)
+            self._buffer.clear()
+        if len(records) > 0:
+            self._write(records)
+
+    def _make_room(self):
+        """Called with the lock held and the buffer full. Returns whether the new record can be added."""
+        if self._overflow_policy == "drop_oldest":
+            self._buffer.popleft()
+            self._dropped += 1
+            return True
+
+        if self._overflow_policy == "block":
+            self._condition.notify_all()
+            deadline = time.monotonic() + self._block_seconds
+            while len(self._buffer) >= self._buffer_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+        return False
+
+    def _ensure_thread_started(self):
+        if self._thread is not None:
+            return
+
+        self._thread = threading.Thread(target=self._run, name="smo-activity-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._closed or len(self._buffer) >= self._batch_size or self._flushed < self._flush_requested,
+                    timeout=self._flush_interval_seconds,
+                )
+                flush_request = self._flush_requested
+                records = list(self._buffer)
+                self._buffer.clear()
+                dropped = self._dropped
+                self._dropped = 0
+                # Room was made in the buffer: wake up anyone blocked by the overflow policy.
+                self._condition.notify_all()
+                closed = self._closed
+
+            try:
+                if dropped > 0:
+                    self._logger.warning(f"Activity buffer was full: {dropped} activity records were dropped.")
+                for start in range(0, len(records), self._batch_size):
+                    self._write(records[start:start + self._batch_size])
+            finally:
+                with self._condition:
+                    self._flushed = max(self._flushed, flush_request)
+                    self._condition.notify_all()
+
+            if closed:
+                return
+
+            if time.monotonic() >= self._next_maintenance:
+                self._next_maintenance = time.monotonic() + self._maintenance_interval_seconds
+                _activity_partitions.maintain()
+
+    def _write(self, records):
+        tracer = trace.get_tracer(__name__)
+        with tracer.start_as_current_span("ActivityWriter.write") as span:
+            if span.is_recording():
+                span.set_attributes({
+                    "db.table": "activity_tracker",
+                    "db.operation": "insert",
+                    "activity.records": len(records),
+                })
+
+            try:
+                with self._get_connection() as conn:
+                    with conn.cursor() as cursor:
+                        _insert_activity_records.execute(cursor, [list(column) for column in zip(*records)])
+                        conn.commit()
+            except psycopg2.Error as e:
+                # Nobody is waiting on these records, so report and move on instead of raising.
+                self._logger.error(f"Error logging {len(records)} activity records: {str(e)}")
+
+
+_activity_partitions = _ActivityPartitions()
+_activity_writer = _ActivityWriter()
+
+
+def flush_activity_log(timeout_seconds=None) -> bool:
+    """Wait until the buffered activity records are in the database."""
+    return _activity_writer.flush(timeout_seconds)
+
+
 class ActivityTracker(BaseRepository):
     def __init__(self, log_name = None, log_level="DEBUG"):
-        super().__init__("Activity Tracker" if log_name is None else log_name, log_level)
+        self._log_name = "Activity Tracker" if log_name is None else log_name
+        super().__init__(self._log_name, log_level)
         self._log_control = {
             "NOTSET": False,
             "DEBUG": False,
@@ -41,57 +390,13 @@ class ActivityTracker(BaseRepository):
         """Delegate tracing to the underlying TracedLogger."""
         return self._logger.trace(span_name)
 
-    def _ensure_table_exists(self):
-        try:
-            with self._get_connection() as conn:
-                with conn.cursor() as cursor:
-                    self._logger.debug("Enabling uuid-ossp extension")
-                    cursor.execute('CREATE EXTENSION IF NOT EXISTS "uuid-ossp";')
-
-                    self._logger.debug(
-                        "Creating activity_tracker table if it does not exist"
-                    )
-                    create_table_query = """
-                                         CREATE TABLE IF NOT EXISTS activity_tracker
-                                         (
-                                             id         UUID PRIMARY KEY   DEFAULT uuid_generate_v4(),
-                                             created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                                             activity   TEXT      NOT NULL
-                                         );"""
-                    cursor.execute(create_table_query)
-                    conn.commit()
-        except psycopg2.Error as e:
-            error_message = f"Error creating the work queue table: {str(e)}"
-            self._logger.error(error_message)
-            raise RuntimeError(error_message) from e
-
     def log_activity(self, activity, log_level):
 
         if not self._log_control[log_level]:
             return
 
-        tracer = trace.get_tracer(__name__)
-        with tracer.start_as_current_span("ActivityTracker.log_activity") as span:
-            if span.is_recording():
-                span.set_attributes({
-                    "db.table": "activity_tracker",
-                    "db.operation": "insert",
-                    "log.level": log_level,
-                })
-
-            try:
-                with self._get_connection() as conn:
-                    with conn.cursor() as cursor:
-                        insert_query = (
-                            "INSERT INTO activity_tracker (activity) VALUES (%s)"
-                        )
-                        cursor.execute(insert_query, (activity,))
-                        conn.commit()
-
-            except psycopg2.Error as e:
-                error_message = f"Error logging activity: {str(e)}"
-                self._logger.error(error_message)
-                raise RuntimeError(error_message) from e
+        # Buffered: the background writer inserts it with the next batch of records.
+        _activity_writer.enqueue(datetime.now(timezone.utc), log_level, self._log_name, activity)
 
     def debug(self, activity):
         self._logger.debug(activity)
@@ -1,38 +1,71 @@
 import os
+import threading
 from contextlib import contextmanager
 
+import psycopg2
 from opentelemetry import trace
-from psycopg2.pool import SimpleConnectionPool
-
-from src.utils import get_otel_log_handler
-
-_db_pool = SimpleConnectionPool(
-    minconn=1,
-    maxconn=20,
-    host=os.environ.get('POSTGRES_HOST', 'localhost'),
-    port=os.environ.get('POSTGRES_PORT', '5432'),
-    user=os.environ.get('POSTGRES_USER', 'postgres'),
-    password=os.environ.get('POSTGRES_PASSWORD', 'postgres'),
-    dbname='smo_watchdog',
+
+from src.data.connection_pool import InstrumentedConnectionPool
+from src.data.migrations import apply_migrations
+from src.utils import get_otel_log_handler, to_int
+
+_db_connection_params = {
+    "host": os.environ.get('POSTGRES_HOST', 'localhost'),
+    "port": os.environ.get('POSTGRES_PORT', '5432'),
+    "user": os.environ.get('POSTGRES_USER', 'postgres'),
+    "password": os.environ.get('POSTGRES_PASSWORD', 'postgres'),
+    "dbname": 'smo_watchdog',
+}
+
+# Shared by every thread of the process (watchdog, queue consumer, batch processor, notifications...).
+_db_pool = InstrumentedConnectionPool(
+    _db_connection_params,
+    min_size=to_int(os.environ.get('DB_POOL_MIN_SIZE'), 1),
+    max_size=to_int(os.environ.get('DB_POOL_MAX_SIZE'), 20),
+    checkout_timeout_seconds=to_int(os.environ.get('DB_POOL_CHECKOUT_TIMEOUT_SECONDS'), 30),
+    validate_after_idle_seconds=to_int(os.environ.get('DB_POOL_VALIDATE_AFTER_IDLE_SECONDS'), 30),
 )
 
+# The schema is migrated once per process, by the first repository created.
+_schema_lock = threading.Lock()
+_schema_ready = False
+
 
 class BaseRepository:
     def __init__(self, log_name: str, log_level: str = "DEBUG"):
         self._logger = get_otel_log_handler(
             log_name, unique_handler_types=True, log_level=log_level
         )
-        self._ensure_table_exists()
+        self._ensure_schema()
 
     @contextmanager
     def _get_connection(self):
         tracer = trace.get_tracer(__name__)
-        with tracer.start_as_current_span("BaseRepository._get_connection"):
-            conn = _db_pool.getconn()
+        with tracer.start_as_current_span("BaseRepository._get_connection") as span:
+            conn, checkout = _db_pool.getconn()
+            if span.is_recording():
+                span.set_attributes({
+                    "db.pool.checkout.wait_ms": checkout["wait_ms"],
+                    "db.pool.checkout.waited": checkout["waited"],
+                    **_db_pool.span_attributes(),
+                })
             try:
                 yield conn
             finally:
                 _db_pool.putconn(conn)
 
-    def _ensure_table_exists(self):
-        pass
+    @staticmethod
+    def _create_dedicated_connection():
+        """Open a connection outside the pool, for long-lived uses like LISTEN."""
+        return psycopg2.connect(**_db_connection_params)
+
+    def _ensure_schema(self):
+        global _schema_ready
+        with _schema_lock:
+            if _schema_ready:
+                return
+
+            with self._get_connection() as conn:
+                apply_migrations(conn, self._logger)
+
+            _schema_ready = True
@@ -0,0 +1,191 @@
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+import psycopg2
+from psycopg2 import extensions
+
+from src.utils import LatencyHistogram, get_otel_log_handler
+
+_logger = get_otel_log_handler("Connection Pool", unique_handler_types=True)
+
+
+class InstrumentedConnectionPool:
+    """
+    Thread-safe Postgres connection pool, shared by every thread of the process.
+
+    - Blocking checkout: when every connection is in use, callers wait (up to a timeout) for one to be returned,
+      instead of failing right away.
+    - Connections idle for a while are validated before being handed out, and replaced if they went stale
+      (e.g.: Postgres restarted, or a firewall dropped the idle connection).
+    - Connections are returned clean: an open transaction is rolled back, a broken connection is discarded.
+    - Checkout wait histogram, in-use count and exhaustion counters, exposed as span attributes.
+    """
+
+    def __init__(
+        self,
+        connection_params: dict,
+        min_size: int = 1,
+        max_size: int = 20,
+        checkout_timeout_seconds: float = 30.0,
+        validate_after_idle_seconds: float = 30.0,
+    ):
+        self._connection_params = connection_params
+        self._max_size = max(1, max_size)
+        self._checkout_timeout_seconds = checkout_timeout_seconds
+        self._validate_after_idle_seconds = validate_after_idle_seconds
+        # (connection, monotonic time it was returned). Last returned is handed out first, so the
+        # connections nobody needs stay idle (and the busy ones don't need validating).
+        self._idle = deque()
+        self._size = 0
+        self._in_use = 0
+        self._peak_in_use = 0
+        self._exhausted = 0
+        self._timeouts = 0
+        self._stale_replaced = 0
+        self._condition = threading.Condition()
+        self.checkout_wait = LatencyHistogram("db.pool.checkout_wait")
+
+        for _ in range(min(max(0, min_size), self._max_size)):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def getconn(self, timeout_seconds: Optional[float] = None):
+        """
+        Check out a connection, waiting up to `timeout_seconds` (the pool's checkout timeout by default)
+        for one to be returned when the pool is exhausted.
+
+        Returns (connection, checkout details). Raises RuntimeError when the wait times out.
+        """
+        timeout_seconds = self._checkout_timeout_seconds if timeout_seconds is None else timeout_seconds
+        start = time.monotonic()
+        deadline = start + timeout_seconds
+        waited = False
+
+        with self._condition:
+            while True:
+                if len(self._idle) > 0:
+                    conn, returned_at = self._idle.pop()
+                    break
+
+                if self._size < self._max_size:
+                    # Reserve the slot now, connect outside the lock.
+                    self._size += 1
+                    conn, returned_at = None, None
+                    break
+
+                if not waited:
+                    waited = True
+                    self._exhausted += 1
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    error_message = f"No database connection available after {timeout_seconds}s: all {self._max_size} connections are in use."
+                    _logger.error(error_message)
+                    raise RuntimeError(error_message)
+
+                self._condition.wait(remaining)
+
+            self._in_use += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+
+        try:
+            if conn is None:
+                conn = self._connect()
+            elif not self._is_usable(conn, returned_at):
+                self._close(conn)
+                conn = self._connect()
+                with self._condition:
+                    self._stale_replaced += 1
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+
+        wait_seconds = time.monotonic() - start
+        self.checkout_wait.observe(wait_seconds)
+        return conn, {"wait_ms": round(wait_seconds * 1000, 3), "waited": waited}
+
+    def putconn(self, conn):
+        """Return a checked out connection, rolling back anything left open. Broken connections are discarded."""
+        keep = not conn.closed
+        if keep:
+            try:
+                status = conn.info.transaction_status
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    keep = False
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                keep = False
+
+        if not keep:
+            self._close(conn)
+
+        with self._condition:
+            self._in_use -= 1
+            if keep:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._size -= 1
+            self._condition.notify()
+
+    def closeall(self):
+        with self._condition:
+            while len(self._idle) > 0:
+                conn, _ = self._idle.pop()
+                self._close(conn)
+                self._size -= 1
+
+    def stats(self) -> dict:
+        with self._condition:
+            stats = {
+                "size": self._size,
+                "max_size": self._max_size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "peak_in_use": self._peak_in_use,
+                "exhausted": self._exhausted,
+                "timeouts": self._timeouts,
+                "stale_replaced": self._stale_replaced,
+            }
+
+        stats["checkout_wait"] = self.checkout_wait.snapshot()
+        return stats
+
+    def span_attributes(self, prefix: str = "db.pool") -> dict:
+        """The pool state and counters, plus the checkout wait summary, ready for span.set_attributes."""
+        stats = self.stats()
+        attributes = {f"{prefix}.{key}": value for key, value in stats.items() if key != "checkout_wait"}
+        attributes.update(self.checkout_wait.span_attributes(f"{prefix}.checkout_wait"))
+        return attributes
+
+    def _connect(self):
+        return psycopg2.connect(**self._connection_params)
+
+    def _is_usable(self, conn, returned_at) -> bool:
+        if conn.closed:
+            return False
+
+        if time.monotonic() - returned_at < self._validate_after_idle_seconds:
+            return True
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error as e:
+            _logger.warning(f"Replacing a stale database connection: {str(e)}")
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
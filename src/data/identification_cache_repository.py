@@ -0,0 +1,217 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import psycopg2
+from psycopg2.extras import Json
+from opentelemetry import trace
+
+from src.data.activity_logger import ActivityTracker
+from src.data.base_repository import BaseRepository
+from src.utils import to_int
+
+_activity_tracker = ActivityTracker("Identification Cache")
+
+_separators = re.compile(r"[\s._\-\[\]()]+")
+
+
+def normalize_release_name(full_path: str) -> str:
+    """
+    Turn a file path into a cache key.
+
+    The key is the release folder (the file's parent) and the file name, each lowercased,
+    with the separators collapsed into dots, and without the file extension. The folder
+    keeps generic or obfuscated names (``movie.mkv``, ``abc123.mkv``) of different releases
+    apart. The episode stays in the key: the API's result (its ``id``, to begin with) is
+    specific to the episode, so episodes of a season pack don't share an entry:
+    ``/watch/Show.Name.S01.1080p/Show.Name.S01E02.1080p.WEB.mkv`` -> ``show.name.s01.1080p/show.name.s01e02.1080p.web``
+    """
+    name, _ = os.path.splitext(os.path.basename(full_path))
+    name = _separators.sub(".", name.lower()).strip(".")
+    if name == "":
+        return ""
+
+    folder = _separators.sub(".", os.path.basename(os.path.dirname(full_path)).lower()).strip(".")
+    return f"{folder}/{name}"
+
+
+class _TtlLruCache:
+    """In-process LRU, where each entry expires after its own TTL."""
+
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns (found, value)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return False, None
+
+            self._entries.move_to_end(key)
+            return True, value
+
+    def put(self, key, value, ttl_seconds: float):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class IdentificationCacheRepository(BaseRepository):
+    """
+    Two-tier cache for the Media Identifier API results: an in-process LRU in front of a Postgres table.
+
+    Positive results and negative results (the API answered 204: nothing useful for that name)
+    live in separate LRUs and have separate TTLs. Negative results expire sooner, since the
+    API may learn about a release later.
+    """
+
+    def __init__(self):
+        super().__init__("Identification Cache")
+        self._logger = _activity_tracker
+        self._ttl_seconds = max(1, to_int(os.environ.get("IDENTIFY_CACHE_TTL_SECONDS"), 7 * 24 * 60 * 60))
+        self._negative_ttl_seconds = max(1, to_int(os.environ.get("IDENTIFY_CACHE_NEGATIVE_TTL_SECONDS"), 60 * 60))
+        max_entries = max(1, to_int(os.environ.get("IDENTIFY_CACHE_MAX_ENTRIES"), 1024))
+        self._positive = _TtlLruCache(max_entries)
+        self._negative = _TtlLruCache(max_entries)
+        # Expired rows are only overwritten when the same name shows up again, so purge them on startup.
+        self._delete_expired()
+
+    def _delete_expired(self):
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("DELETE FROM identification_cache WHERE expires_at <= CURRENT_TIMESTAMP;")
+                    conn.commit()
+        except psycopg2.Error as e:
+            error_message = f"Error deleting the expired identification cache entries: {str(e)}"
+            self._logger.error(error_message)
+            raise RuntimeError(error_message) from e
+
+    @_activity_tracker.trace("IdentificationCacheRepository.get")
+    def get(self, cache_key: str):
+        """
+        Look the key up in memory, then in the database.
+
+        Returns a tuple: (found, media info). A negative result is (True, None).
+        """
+        span = trace.get_current_span()
+
+        for tier_name, tier in [("memory", self._positive), ("memory_negative", self._negative)]:
+            found, media_info = tier.get(cache_key)
+            if found:
+                if span.is_recording():
+                    span.set_attributes({"cache.key": cache_key, "cache.tier": tier_name})
+                return True, media_info
+
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        """SELECT media_info, is_negative, EXTRACT(EPOCH FROM expires_at - CURRENT_TIMESTAMP)
+                           FROM identification_cache
+                           WHERE cache_key = %s AND expires_at > CURRENT_TIMESTAMP""",
+                        (cache_key,),
+                    )
+                    row = cursor.fetchone()
+                    conn.commit()
+        except psycopg2.Error as e:
+            error_message = f"Error reading the identification cache for [{cache_key}]: {str(e)}"
+            self._logger.error(error_message)
+            raise RuntimeError(error_message) from e
+
+        if row is None:
+            if span.is_recording():
+                span.set_attributes({"cache.key": cache_key, "cache.tier": "miss"})
+            return False, None
+
+        media_info, is_negative, remaining_seconds = row
+        if is_negative:
+            self._negative.put(cache_key, None, float(remaining_seconds))
+        else:
+            self._positive.put(cache_key, media_info, float(remaining_seconds))
+
+        if span.is_recording():
+            span.set_attributes({
+                "cache.key": cache_key,
+                "cache.tier": "database_negative" if is_negative else "database",
+            })
+
+        return True, None if is_negative else media_info
+
+    @_activity_tracker.trace("IdentificationCacheRepository.put")
+    def put(self, cache_key: str, media_info: Optional[dict]):
+        """Store a result. `media_info` None stores a negative result."""
+        is_negative = media_info is None
+        ttl_seconds = self._negative_ttl_seconds if is_negative else self._ttl_seconds
+
+        if is_negative:
+            self._positive.discard(cache_key)
+            self._negative.put(cache_key, None, ttl_seconds)
+        else:
+            self._negative.discard(cache_key)
+            self._positive.put(cache_key, media_info, ttl_seconds)
+
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        """INSERT INTO identification_cache (cache_key, media_info, is_negative, expires_at)
+                           VALUES (%s, %s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+                           ON CONFLICT (cache_key) DO UPDATE
+                           SET media_info = EXCLUDED.media_info,
+                               is_negative = EXCLUDED.is_negative,
+                               expires_at = EXCLUDED.expires_at,
+                               modified_at = CURRENT_TIMESTAMP""",
+                        (cache_key, None if is_negative else Json(media_info), is_negative, ttl_seconds),
+                    )
+                    conn.commit()
+        except psycopg2.Error as e:
+            error_message = f"Error writing the identification cache for [{cache_key}]: {str(e)}"
+            self._logger.error(error_message)
+            raise RuntimeError(error_message) from e
+
+    @_activity_tracker.trace("IdentificationCacheRepository.invalidate")
+    def invalidate(self, cache_key: Optional[str] = None) -> int:
+        """Drop one key from both tiers, or everything when no key is given. Returns the rows deleted."""
+        if cache_key is None:
+            self._positive.clear()
+            self._negative.clear()
+        else:
+            self._positive.discard(cache_key)
+            self._negative.discard(cache_key)
+
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    if cache_key is None:
+                        cursor.execute("DELETE FROM identification_cache")
+                    else:
+                        cursor.execute("DELETE FROM identification_cache WHERE cache_key = %s", (cache_key,))
+                    deleted = cursor.rowcount
+                    conn.commit()
+                    return deleted
+        except psycopg2.Error as e:
+            error_message = f"Error invalidating the identification cache: {str(e)}"
+            self._logger.error(error_message)
+            raise RuntimeError(error_message) from e
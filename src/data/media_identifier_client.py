@@ -0,0 +1,231 @@
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+import requests
+from opentelemetry import trace
+from requests.adapters import HTTPAdapter
+
+from src.utils import LatencyHistogram, get_otel_log_handler, to_int
+
+_logger = get_otel_log_handler("Media Identifier Client", unique_handler_types=True)
+
+# Answers that mean "try again later", as opposed to a real answer about the file.
+_retryable_status_codes = {429, 500, 502, 503, 504}
+# Answers from a server that doesn't have the bulk endpoint.
+_bulk_unsupported_status_codes = {404, 405, 501}
+
+
+def _to_float(value: Optional[str], default: float) -> float:
+    try:
+        if value is None:
+            return default
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class MediaIdentifierClient:
+    """
+    Shared HTTP client for the Media Identifier API (`API_URL`).
+
+    - One requests.Session with a keep-alive connection pool, so items don't pay a new TCP/TLS handshake each.
+    - Connect and read timeouts, so a hung API can't block a batch forever.
+    - Bounded retries with exponential backoff and full jitter, for connection errors, timeouts and 429/5xx.
+    - Latency histograms per attempt and per call (retries included), exposed as span attributes.
+    """
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        connect_timeout_seconds: Optional[float] = None,
+        read_timeout_seconds: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        backoff_base_seconds: Optional[float] = None,
+        backoff_max_seconds: Optional[float] = None,
+        pool_size: Optional[int] = None,
+        bulk_path: Optional[str] = None,
+    ):
+        self.base_url = base_url or os.environ.get('API_URL')
+        self._timeout = (
+            connect_timeout_seconds if connect_timeout_seconds is not None
+            else _to_float(os.environ.get("IDENTIFY_CONNECT_TIMEOUT_SECONDS"), 3.0),
+            read_timeout_seconds if read_timeout_seconds is not None
+            else _to_float(os.environ.get("IDENTIFY_READ_TIMEOUT_SECONDS"), 30.0),
+        )
+        self._max_retries = max(0, max_retries if max_retries is not None else to_int(os.environ.get("IDENTIFY_MAX_RETRIES"), 3))
+        self._backoff_base_seconds = backoff_base_seconds if backoff_base_seconds is not None else _to_float(os.environ.get("IDENTIFY_BACKOFF_BASE_SECONDS"), 0.5)
+        self._backoff_max_seconds = backoff_max_seconds if backoff_max_seconds is not None else _to_float(os.environ.get("IDENTIFY_BACKOFF_MAX_SECONDS"), 10.0)
+        pool_size = max(1, pool_size if pool_size is not None else to_int(os.environ.get("IDENTIFY_POOL_SIZE"), 8))
+        self._bulk_path = bulk_path if bulk_path is not None else (os.environ.get("IDENTIFY_BULK_PATH") or "bulk")
+        # None until the first bulk call tells us whether the server has the endpoint.
+        self._bulk_supported: Optional[bool] = None
+
+        self._session = requests.Session()
+        # Retries are handled here (with jitter and metrics), not by urllib3.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0, pool_block=True)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+        self.attempt_latency = LatencyHistogram("identifier.attempt")
+        self.call_latency = LatencyHistogram("identifier.call")
+        self._retries = 0
+        self._lock = threading.Lock()
+
+    @_logger.trace("MediaIdentifierClient.get")
+    def get(self, params: Optional[dict] = None, path: str = "") -> requests.Response:
+        """
+        GET `API_URL` (+ path), retrying transient failures.
+
+        Returns the last response, even if it is a retryable status code.
+        Raises requests.RequestException when the last attempt failed without a response.
+        """
+        return self._request("GET", path, params=params)
+
+    @_logger.trace("MediaIdentifierClient.post")
+    def post(self, json=None, path: str = "") -> requests.Response:
+        return self._request("POST", path, json=json)
+
+    @_logger.trace("MediaIdentifierClient.identify_many")
+    def identify_many(self, full_paths: list[str]) -> Optional[dict]:
+        """
+        Identify several paths in one round-trip: POST `API_URL`/bulk with ``{"items": [paths]}``.
+
+        The server answers ``{"results": ...}`` (or just the results), either as a list in the same
+        order as the paths or as a dict keyed by path. Each result is the media info, or null when
+        there's nothing useful for that path (the bulk version of a 204).
+
+        Returns {path: media info or None}, or None when the server doesn't support bulk requests
+        (remembered, so we stop asking) or the request failed. Callers then fall back to one call per path.
+        """
+        span = trace.get_current_span()
+        if span.is_recording():
+            span.set_attribute("identifier.bulk_size", len(full_paths))
+
+        if self._bulk_supported is False or len(full_paths) == 0:
+            return None
+
+        try:
+            response = self._request("POST", self._bulk_path, json={"items": list(full_paths)})
+        except requests.RequestException as e:
+            _logger.warning(f"Bulk identification of {len(full_paths)} paths failed: {str(e)}")
+            return None
+
+        if response.status_code in _bulk_unsupported_status_codes:
+            _logger.info(
+                f"Media Identifier API doesn't support bulk requests ({response.status_code}). "
+                f"Identifying one path at a time from now on."
+            )
+            self._bulk_supported = False
+            return None
+
+        if not response.ok:
+            _logger.warning(
+                f"Bulk identification of {len(full_paths)} paths failed ({response.status_code}): {response.text}"
+            )
+            return None
+
+        try:
+            body = response.json()
+        except ValueError as e:
+            _logger.warning(f"Bulk identification returned an invalid body: {str(e)}")
+            return None
+
+        results = body.get("results") if isinstance(body, dict) else body
+        if isinstance(results, list) and len(results) == len(full_paths):
+            mapped = dict(zip(full_paths, results))
+        elif isinstance(results, dict):
+            mapped = {path: results.get(path) for path in full_paths if path in results}
+        else:
+            _logger.warning(f"Bulk identification returned an unexpected body for {len(full_paths)} paths.")
+            return None
+
+        self._bulk_supported = True
+        return {path: media_info if isinstance(media_info, dict) else None for path, media_info in mapped.items()}
+
+    def stats(self) -> dict:
+        with self._lock:
+            retries = self._retries
+
+        return {
+            "retries": retries,
+            "attempt_latency": self.attempt_latency.snapshot(),
+            "call_latency": self.call_latency.snapshot(),
+        }
+
+    def close(self):
+        self._session.close()
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        span = trace.get_current_span()
+        url = self._build_url(path)
+        call_start = time.monotonic()
+        attempt = 0
+
+        while True:
+            attempt += 1
+            attempt_start = time.monotonic()
+            response = None
+            error = None
+            try:
+                response = self._session.request(method, url, timeout=self._timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            finally:
+                self.attempt_latency.observe(time.monotonic() - attempt_start)
+
+            retryable = error is not None or response.status_code in _retryable_status_codes
+            if not retryable or attempt > self._max_retries:
+                break
+
+            delay_seconds = self._get_backoff_delay(attempt, response)
+            _logger.warning(
+                f"Media Identifier API {method} attempt {attempt} failed "
+                f"({error if error is not None else response.status_code}). Retrying in {delay_seconds:.2f}s..."
+            )
+            with self._lock:
+                self._retries += 1
+            if response is not None:
+                response.close()
+            time.sleep(delay_seconds)
+
+        self.call_latency.observe(time.monotonic() - call_start)
+
+        if span.is_recording():
+            span.set_attributes({
+                "http.method": method,
+                "http.url": url,
+                "http.attempts": attempt,
+                **({"http.status_code": response.status_code} if response is not None else {}),
+                **self.attempt_latency.span_attributes("identifier.attempt_latency"),
+                **self.call_latency.span_attributes("identifier.call_latency"),
+            })
+
+        if error is not None:
+            raise error
+
+        return response
+
+    def _build_url(self, path: str) -> str:
+        if self.base_url is None:
+            raise ValueError("Media Identifier API not configured. Set the API_URL environment variable.")
+
+        if not path:
+            return self.base_url
+
+        return f"{self.base_url.rstrip('/')}/{path.lstrip('/')}"
+
+    def _get_backoff_delay(self, attempt: int, response: Optional[requests.Response]) -> float:
+        # Full jitter: random between 0 and the exponential cap, so parallel workers don't retry in lockstep.
+        delay_seconds = random.uniform(0, min(self._backoff_max_seconds, self._backoff_base_seconds * (2 ** (attempt - 1))))
+
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after is not None:
+            delay_seconds = max(delay_seconds, min(self._backoff_max_seconds, _to_float(retry_after, 0.0)))
+
+        return delay_seconds
+
+
+media_identifier_client = MediaIdentifierClient()
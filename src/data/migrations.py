@@ -0,0 +1,192 @@
+"""
+Versioned schema migrations.
+
+Each migration runs once per database, in order, in its own transaction, and is recorded in
+schema_migrations. A session-level advisory lock makes concurrent processes (e.g.: main.py and
+on_demand.py starting at the same time) wait for each other instead of racing.
+
+To change the schema, append a new migration with the next version number. Never edit one that
+was already released: databases that applied it won't run it again.
+"""
+import psycopg2
+
+_migrations_lock_key = "smo_schema_migrations"
+
+
+def _convert_activity_tracker_to_partitioned(cursor):
+    cursor.execute("""SELECT c.relkind
+                      FROM pg_class c
+                      JOIN pg_namespace n ON n.oid = c.relnamespace
+                      WHERE c.relname = 'activity_tracker' AND n.nspname = current_schema()""")
+    row = cursor.fetchone()
+    relkind = row[0] if row is not None else None
+
+    if relkind == 'p':
+        return
+
+    if relkind == 'r':
+        cursor.execute("ALTER TABLE activity_tracker RENAME TO activity_tracker_legacy;")
+        cursor.execute("ALTER TABLE activity_tracker_legacy RENAME CONSTRAINT activity_tracker_pkey TO activity_tracker_legacy_pkey;")
+        cursor.execute("""ALTER TABLE activity_tracker_legacy
+                              ADD COLUMN IF NOT EXISTS level TEXT NULL,
+                              ADD COLUMN IF NOT EXISTS source_logger TEXT NULL;""")
+
+    cursor.execute("""CREATE TABLE activity_tracker
+                      (
+                          id            UUID      NOT NULL DEFAULT uuid_generate_v4(),
+                          created_at    TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                          activity      TEXT      NOT NULL,
+                          level         TEXT      NULL,
+                          source_logger TEXT      NULL,
+                          PRIMARY KEY (id, created_at)
+                      ) PARTITION BY RANGE (created_at);""")
+    cursor.execute("CREATE INDEX idx_activity_tracker_created_at ON activity_tracker (created_at);")
+
+    if relkind == 'r':
+        # Everything logged so far stays in the old table, now the oldest partition (up to the end of
+        # the current month, which works for daily and monthly partitions). No rows are copied.
+        cursor.execute("""SELECT date_trunc('month', GREATEST(MAX(created_at), LOCALTIMESTAMP)) + INTERVAL '1 month'
+                          FROM activity_tracker_legacy;""")
+        legacy_end = cursor.fetchone()[0]
+        cursor.execute(
+            "ALTER TABLE activity_tracker ATTACH PARTITION activity_tracker_legacy FOR VALUES FROM (MINVALUE) TO (%s);",
+            (legacy_end,),
+        )
+
+    cursor.execute("CREATE TABLE activity_tracker_default PARTITION OF activity_tracker DEFAULT;")
+
+
+# (version, description, list of SQL statements or a function receiving the cursor)
+_migrations = [
+    (1, "Base tables", [
+        'CREATE EXTENSION IF NOT EXISTS "uuid-ossp";',
+        # IF NOT EXISTS: databases created before the migrations already have these tables.
+        """CREATE TABLE IF NOT EXISTS work_queue (
+               id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+               full_path TEXT NOT NULL,
+               filename TEXT NOT NULL,
+               parent TEXT NOT NULL,
+               target_path TEXT NULL,
+               status TEXT NOT NULL,
+               is_archive BOOLEAN NOT NULL DEFAULT FALSE,
+               is_main_archive_file BOOLEAN NOT NULL DEFAULT FALSE,
+               created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+               modified_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+               media_info_cache_id UUID NULL);""",
+        # SHA-256 of the source, computed while copying. Saves reading the source again to verify it.
+        "ALTER TABLE work_queue ADD COLUMN IF NOT EXISTS source_sha256 TEXT NULL;",
+        """CREATE TABLE IF NOT EXISTS batch_control (
+               batch_id UUID NOT NULL,
+               work_queue_id UUID NOT NULL,
+               in_progress BOOLEAN NOT NULL DEFAULT FALSE,
+               verified BOOLEAN NOT NULL DEFAULT FALSE,
+               created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+               modified_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP);""",
+        """CREATE TABLE IF NOT EXISTS identification_cache (
+               cache_key TEXT PRIMARY KEY,
+               media_info JSONB NULL,
+               is_negative BOOLEAN NOT NULL DEFAULT FALSE,
+               expires_at TIMESTAMP NOT NULL,
+               created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+               modified_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP);""",
+    ]),
+    (2, "Partitioned activity_tracker, with level and source_logger", _convert_activity_tracker_to_partitioned),
+    (3, "Indexes for the work queue hot paths, and batch_control foreign key", [
+        # get_next_batch and the stragglers reset only look at active items, a tiny part of the table.
+        """CREATE INDEX IF NOT EXISTS idx_work_queue_active_status
+               ON work_queue (status, created_at)
+               WHERE status IN ('PENDING', 'WORKING');""",
+        "CREATE INDEX IF NOT EXISTS idx_work_queue_filename ON work_queue (filename);",
+        "CREATE INDEX IF NOT EXISTS idx_batch_control_batch_id ON batch_control (batch_id);",
+        "CREATE INDEX IF NOT EXISTS idx_batch_control_work_queue_id ON batch_control (work_queue_id);",
+        "CREATE INDEX IF NOT EXISTS idx_identification_cache_expires_at ON identification_cache (expires_at);",
+        # NOT VALID: enforced for new rows, without failing on (or deleting) old orphans.
+        """ALTER TABLE batch_control
+               ADD CONSTRAINT fk_batch_control_work_queue
+               FOREIGN KEY (work_queue_id) REFERENCES work_queue (id) NOT VALID;""",
+    ]),
+    (4, "Work item leases, so several workers can share the queue", [
+        # TIMESTAMPTZ: every worker compares it with the same clock, whatever the time zone of its session.
+        # The lease checks only look at WORKING items, already covered by idx_work_queue_active_status.
+        """ALTER TABLE work_queue
+               ADD COLUMN IF NOT EXISTS leased_by TEXT NULL,
+               ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ NULL;""",
+    ]),
+    (5, "Work item attempts and retry schedule", [
+        """ALTER TABLE work_queue
+               ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0,
+               ADD COLUMN IF NOT EXISTS last_error TEXT NULL,
+               ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMPTZ NULL;""",
+    ]),
+    (6, "One active work item per path, and file fingerprints", [
+        """ALTER TABLE work_queue
+               ADD COLUMN IF NOT EXISTS file_size BIGINT NULL,
+               ADD COLUMN IF NOT EXISTS file_mtime_ns BIGINT NULL;""",
+        # Keep one active item per path (the one being worked on, or the oldest), ignore the other copies.
+        """UPDATE work_queue AS w
+               SET status = 'IGNORED',
+                   last_error = 'Duplicate of ' || d.kept_id,
+                   modified_at = CURRENT_TIMESTAMP
+               FROM (SELECT id,
+                            first_value(id) OVER (PARTITION BY full_path ORDER BY (status = 'WORKING') DESC, created_at) AS kept_id
+                     FROM work_queue
+                     WHERE status IN ('PENDING', 'WORKING')) AS d
+               WHERE w.id = d.id
+                 AND d.id <> d.kept_id;""",
+        """CREATE UNIQUE INDEX IF NOT EXISTS uq_work_queue_active_full_path
+               ON work_queue (full_path)
+               WHERE status IN ('PENDING', 'WORKING');""",
+        # Finished items are looked up by path when their file is detected again.
+        "CREATE INDEX IF NOT EXISTS idx_work_queue_full_path ON work_queue (full_path);",
+    ]),
+    (7, "Identification cache keyed per episode", [
+        # Entries were shared by every episode of a season, with the id of whichever episode was identified first.
+        "DELETE FROM identification_cache;",
+    ]),
+]
+
+
+def apply_migrations(conn, logger):
+    """Apply the migrations this database doesn't have yet. Raises RuntimeError if one fails."""
+    version = None
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_lock(hashtext(%s));", (_migrations_lock_key,))
+            conn.commit()
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""CREATE TABLE IF NOT EXISTS schema_migrations (
+                                      version INTEGER PRIMARY KEY,
+                                      description TEXT NOT NULL,
+                                      applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP);""")
+                cursor.execute("SELECT version FROM schema_migrations;")
+                applied = {row[0] for row in cursor.fetchall()}
+                conn.commit()
+
+                for version, description, steps in _migrations:
+                    if version in applied:
+                        continue
+
+                    logger.info(f"Applying schema migration {version}: {description}")
+                    if callable(steps):
+                        steps(cursor)
+                    else:
+                        for statement in steps:
+                            cursor.execute(statement)
+
+                    cursor.execute(
+                        "INSERT INTO schema_migrations (version, description) VALUES (%s, %s);",
+                        (version, description),
+                    )
+                    conn.commit()
+        finally:
+            conn.rollback()
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(hashtext(%s));", (_migrations_lock_key,))
+            conn.commit()
+
+    except psycopg2.Error as e:
+        error_message = f"Error applying schema migration {version}: {str(e)}" if version is not None else f"Error applying schema migrations: {str(e)}"
+        logger.error(error_message)
+        raise RuntimeError(error_message) from e
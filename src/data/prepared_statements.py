@@ -0,0 +1,64 @@
+"""
+Named server-side prepared statements, for the queries that run all day long.
+
+Postgres parses and plans a prepared statement once per connection, instead of on every call.
+Each statement is prepared the first time it is used on a (pooled) connection, and stays there
+for the life of the connection: PREPARE is not undone by a rollback. A connection replaced by the
+pool starts with nothing prepared.
+
+Queries are written with psycopg2 placeholders (%s), so the same text can still be run as a
+plain query (see DB_PREPARED_STATEMENTS, and benchmarks/bench_prepared_statements.py).
+"""
+import re
+import threading
+import weakref
+from typing import Sequence
+
+from src.utils import to_bool_env
+
+# Disable behind poolers that don't keep server-side state between transactions (e.g.: PgBouncer in transaction mode).
+_prepared_statements_enabled = to_bool_env("DB_PREPARED_STATEMENTS", True)
+
+_placeholder = re.compile(r"%s")
+_valid_name = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+# Names of the statements already prepared on each connection.
+_prepared_by_connection = weakref.WeakKeyDictionary()
+_prepared_lock = threading.Lock()
+
+
+class PreparedStatement:
+    def __init__(self, name: str, parameter_types: Sequence[str], query: str):
+        if _valid_name.match(name) is None:
+            raise ValueError(f"Invalid prepared statement name: {name}")
+
+        parameter_count = len(_placeholder.findall(query))
+        if parameter_count != len(parameter_types):
+            raise ValueError(f"Prepared statement [{name}] has {parameter_count} placeholders, but {len(parameter_types)} parameter types")
+
+        self.name = name
+        self.query = query
+
+        numbers = iter(range(1, parameter_count + 1))
+        numbered_query = _placeholder.sub(lambda _: f"${next(numbers)}", query)
+        types = f" ({', '.join(parameter_types)})" if parameter_count > 0 else ""
+        self._prepare_query = f"PREPARE {name}{types} AS {numbered_query}"
+        self._execute_query = f"EXECUTE {name} ({', '.join(['%s'] * parameter_count)})" if parameter_count > 0 else f"EXECUTE {name}"
+
+    def execute(self, cursor, params: Sequence = ()):
+        """Run the statement on the cursor, preparing it on the cursor's connection first if needed."""
+        if not _prepared_statements_enabled:
+            cursor.execute(self.query, params)
+            return
+
+        conn = cursor.connection
+        with _prepared_lock:
+            prepared = _prepared_by_connection.setdefault(conn, set())
+            is_prepared = self.name in prepared
+
+        if not is_prepared:
+            cursor.execute(self._prepare_query)
+            with _prepared_lock:
+                prepared.add(self.name)
+
+        cursor.execute(self._execute_query, params)
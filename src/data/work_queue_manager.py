@@ -1,87 +1,336 @@
+import os
+import select
+import socket
+import threading
+import time
 import uuid
 
 import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2.extras import execute_values
 from opentelemetry import trace
 
 from src.data.activity_logger import ActivityTracker
 from src.data.base_repository import BaseRepository
+from src.data.prepared_statements import PreparedStatement
+from src.utils import get_env, to_int
 
 _activity_tracker = ActivityTracker("Work Queue Manager")
 
+# Identifies this process in the leases of the items it claims. Must be unique per running worker.
+_worker_id = get_env("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+# How long a claimed item stays leased without a heartbeat. Once expired, any worker can put it back to PENDING.
+_lease_seconds = max(10, to_int(os.environ.get("WORK_QUEUE_LEASE_SECONDS"), 120))
+_heartbeat_interval_seconds = max(1, to_int(os.environ.get("WORK_QUEUE_HEARTBEAT_SECONDS"), _lease_seconds // 3))
+# Claims an item can take before it is given up on (FAILED_MAX_ATTEMPTS), and the wait between them.
+_max_attempts = max(1, to_int(os.environ.get("WORK_ITEM_MAX_ATTEMPTS"), 5))
+_backoff_base_seconds = max(0, to_int(os.environ.get("WORK_ITEM_BACKOFF_BASE_SECONDS"), 60))
+_backoff_max_seconds = max(0, to_int(os.environ.get("WORK_ITEM_BACKOFF_MAX_SECONDS"), 3600))
+
+_heartbeat_lock = threading.Lock()
+_heartbeat_thread = None
+# Batches this process is working on. Only their items get their leases renewed.
+_active_batch_ids = set()
+_active_batch_ids_lock = threading.Lock()
+
+# Postgres NOTIFY channel used to wake up the batch processor when there's new work.
+_work_queue_channel = "smo_work_queue"
+
+# Columns a work item can change, and their types. Used to cast the VALUES list of bulk updates
+# (a NULL, or a string, in VALUES is "text" for Postgres, which can't be assigned to a UUID column).
+_work_item_column_types = {
+    "full_path": "text",
+    "filename": "text",
+    "parent": "text",
+    "target_path": "text",
+    "status": "text",
+    "is_archive": "boolean",
+    "is_main_archive_file": "boolean",
+    "media_info_cache_id": "uuid",
+    "source_sha256": "text",
+    "leased_by": "text",
+    "lease_expires_at": "timestamptz",
+    "attempts": "integer",
+    "last_error": "text",
+    "next_attempt_at": "timestamptz",
+    "file_size": "bigint",
+    "file_mtime_ns": "bigint",
+}
+_read_only_work_item_keys = {"id", "created_at", "modified_at"}
+
+# Columns read into a work item, in the order _parse_work_item_row_to_object expects them.
+_work_item_columns = "id, full_path, filename, parent, target_path, status, is_archive, is_main_archive_file, created_at, modified_at, media_info_cache_id, source_sha256, attempts, last_error, next_attempt_at, file_size, file_mtime_ns"
+
+# PENDING items that can be claimed now: new ones, and retries whose backoff is over.
+_due_condition = "status = 'PENDING' AND (next_attempt_at IS NULL OR next_attempt_at <= CURRENT_TIMESTAMP)"
+
+# Claims the oldest due PENDING items (all of them when the limit is NULL), leases them to this worker,
+# counts the attempt, and registers them in batch_control, in a single statement, no matter how many
+# items are claimed.
+# SKIP LOCKED: workers claiming at the same time get different items, instead of waiting for each other.
+# Parameters: worker id, lease seconds, limit, batch id.
+_claim_batch_query = f"""
+                     WITH claimed AS (
+                         UPDATE work_queue
+                         SET status = 'WORKING',
+                             attempts = attempts + 1,
+                             leased_by = %s,
+                             lease_expires_at = CURRENT_TIMESTAMP + make_interval(secs => %s),
+                             modified_at = CURRENT_TIMESTAMP
+                         WHERE id IN (SELECT id
+                                      FROM work_queue
+                                      WHERE {_due_condition}
+                                      ORDER BY created_at
+                                      LIMIT %s
+                                      FOR UPDATE SKIP LOCKED)
+                         RETURNING {_work_item_columns}
+                     ), registered AS (
+                         INSERT INTO batch_control (batch_id, work_queue_id, in_progress)
+                         SELECT %s::uuid, id, TRUE
+                         FROM claimed
+                     )
+                     SELECT {_work_item_columns}
+                     FROM claimed
+                     ORDER BY created_at"""
+
+# Gives WORKING items back: to PENDING, not claimable before an exponential backoff
+# (base * 2^(attempts - 1), capped), or to FAILED_MAX_ATTEMPTS once all their attempts were used.
+# Parameters: max attempts, max attempts, backoff base seconds, backoff max seconds.
+_release_set_clause = """status           = CASE WHEN attempts >= %s THEN 'FAILED_MAX_ATTEMPTS' ELSE 'PENDING' END,
+                         next_attempt_at  = CASE WHEN attempts >= %s THEN NULL
+                                                 ELSE CURRENT_TIMESTAMP + make_interval(secs => LEAST(%s * power(2, LEAST(GREATEST(attempts - 1, 0), 30)), %s))
+                                            END,
+                         leased_by        = NULL,
+                         lease_expires_at = NULL,
+                         modified_at      = CURRENT_TIMESTAMP"""
+_release_params = (_max_attempts, _max_attempts, _backoff_base_seconds, _backoff_max_seconds)
+_release_types = ("integer", "integer", "integer", "integer")
+# Status of each released item, and whether it can be claimed right away (only with no backoff).
+_release_returning = "status, COALESCE(next_attempt_at <= CURRENT_TIMESTAMP, TRUE)"
+
+# How many PENDING items are due (up to the limit), and whether the oldest one waited long enough.
+# Parameters: max age seconds, limit.
+_count_due_items_query = f"""
+                         SELECT COUNT(*),
+                                COALESCE(MIN(created_at) <= CURRENT_TIMESTAMP - (%s * INTERVAL '1 second'), FALSE)
+                         FROM (SELECT created_at
+                               FROM work_queue
+                               WHERE {_due_condition}
+                               ORDER BY created_at
+                               LIMIT %s) AS pending"""
+
+# Columns `update` writes for a work item read from the database (its editable columns).
+_update_item_columns = (
+    "full_path", "filename", "parent", "target_path", "status", "is_archive", "is_main_archive_file",
+    "media_info_cache_id", "source_sha256", "attempts", "last_error", "next_attempt_at", "file_size", "file_mtime_ns",
+)
+
+# Columns of a new work item, as given to add_to_queue.
+_enqueue_columns = (
+    "full_path", "filename", "parent", "target_path", "status", "is_archive", "is_main_archive_file",
+    "media_info_cache_id", "file_size", "file_mtime_ns",
+)
+
+# Adds files to the queue, unless they are already there, so detecting a file again is harmless:
+# - A path with an active (PENDING/WORKING) item gets that item back. A PENDING one gets the new fingerprint.
+# - A file already DONE (or IGNORED) with the same fingerprint (size and mtime) gets that item back.
+# - Anything else (new files, files that changed since, or that failed) is added.
+# Returns (full_path, id, whether a new PENDING item was added) per file. {values}: one row per file.
+_enqueue_query_template = f"""
+    WITH incoming ({", ".join(_enqueue_columns)}) AS (
+        VALUES {{values}}
+    ), finished AS (
+        SELECT DISTINCT ON (i.full_path) i.full_path, w.id
+        FROM incoming AS i
+        JOIN work_queue AS w ON w.full_path = i.full_path
+                            AND w.status IN ('DONE', 'IGNORED')
+                            AND w.file_size = i.file_size
+                            AND w.file_mtime_ns = i.file_mtime_ns
+        ORDER BY i.full_path, w.created_at DESC
+    ), upserted AS (
+        INSERT INTO work_queue AS w ({", ".join(_enqueue_columns)})
+        SELECT i.*
+        FROM incoming AS i
+        WHERE NOT EXISTS (SELECT 1 FROM finished AS f WHERE f.full_path = i.full_path)
+        ON CONFLICT (full_path) WHERE status IN ('PENDING', 'WORKING')
+        DO UPDATE SET file_size     = CASE WHEN w.status = 'PENDING' THEN EXCLUDED.file_size ELSE w.file_size END,
+                      file_mtime_ns = CASE WHEN w.status = 'PENDING' THEN EXCLUDED.file_mtime_ns ELSE w.file_mtime_ns END
+        RETURNING w.full_path, w.id, (w.xmax = 0 AND w.status = 'PENDING') AS added_pending
+    )
+    SELECT full_path, id, added_pending FROM upserted
+    UNION ALL
+    SELECT full_path, id, FALSE FROM finished"""
+_enqueue_types = ("text", "text", "text", "text", "text", "boolean", "boolean", "uuid", "bigint", "bigint")
+
+# The statements run for every item or batch, prepared once per pooled connection.
+_enqueue_item = PreparedStatement(
+    "smo_enqueue_work_item",
+    _enqueue_types,
+    _enqueue_query_template.format(values=f"({', '.join(['%s'] * len(_enqueue_columns))})"),
+)
+_update_item = PreparedStatement(
+    "smo_update_work_item",
+    tuple(_work_item_column_types[column] for column in _update_item_columns) + ("uuid",),
+    f"UPDATE work_queue SET {', '.join(f'{column} = %s' for column in _update_item_columns)} WHERE id = %s",
+)
+_count_due_items = PreparedStatement("smo_count_due_work_items", ("integer", "bigint"), _count_due_items_query)
+_claim_batch = PreparedStatement("smo_claim_batch", ("text", "integer", "bigint", "uuid"), _claim_batch_query)
+_release_batch_items = PreparedStatement(
+    "smo_release_batch_items",
+    _release_types + ("text", "uuid"),
+    f"""UPDATE work_queue
+        SET {_release_set_clause}
+        WHERE status = 'WORKING'
+          AND leased_by = %s
+          AND id IN (SELECT work_queue_id FROM batch_control WHERE batch_id = %s)
+        RETURNING {_release_returning}""",
+)
+_release_worker_items = PreparedStatement(
+    "smo_release_worker_items",
+    _release_types + ("text",),
+    f"""UPDATE work_queue
+        SET {_release_set_clause}
+        WHERE status = 'WORKING'
+          AND leased_by = %s
+        RETURNING {_release_returning}""",
+)
+# The SET expressions see the row before the update, so last_error gets the old lease holder.
+_release_expired_items = PreparedStatement(
+    "smo_release_expired_items",
+    _release_types,
+    f"""UPDATE work_queue
+        SET {_release_set_clause},
+            last_error = 'Lease of [' || COALESCE(leased_by, 'unknown worker') || '] expired'
+        WHERE status = 'WORKING'
+          AND (lease_expires_at IS NULL OR lease_expires_at < CURRENT_TIMESTAMP)
+        RETURNING {_release_returning}""",
+)
+_renew_leases = PreparedStatement(
+    "smo_renew_leases",
+    ("integer", "text", "text[]"),
+    """UPDATE work_queue
+       SET lease_expires_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+       WHERE status = 'WORKING'
+         AND leased_by = %s
+         AND id IN (SELECT work_queue_id FROM batch_control WHERE batch_id = ANY(%s::uuid[]))""",
+)
+_seconds_until_next_retry = PreparedStatement(
+    "smo_seconds_until_next_retry",
+    (),
+    """SELECT EXTRACT(EPOCH FROM MIN(next_attempt_at) - CURRENT_TIMESTAMP)
+       FROM work_queue
+       WHERE status = 'PENDING'
+         AND next_attempt_at > CURRENT_TIMESTAMP""",
+)
+_set_batch_as_done = PreparedStatement(
+    "smo_set_batch_as_done",
+    ("uuid",),
+    "UPDATE batch_control SET in_progress = FALSE, modified_at = CURRENT_TIMESTAMP WHERE batch_id = %s",
+)
+_get_batch_items = PreparedStatement(
+    "smo_get_batch_items",
+    ("uuid",),
+    f"""SELECT {_work_item_columns} FROM work_queue
+        WHERE id IN (SELECT work_queue_id FROM batch_control WHERE batch_id = %s)""",
+)
+_update_batch_verification = PreparedStatement(
+    "smo_update_batch_verification",
+    ("boolean", "uuid"),
+    """UPDATE batch_control
+       SET verified = %s,
+           modified_at = CURRENT_TIMESTAMP
+       WHERE batch_id = %s""",
+)
+
 
 class WorkQueueManager(BaseRepository):
     def __init__(self):
         super().__init__("Work Queue Manager")
         self._logger = _activity_tracker
+        self._listen_connection = None
+
+    @_activity_tracker.trace("WorkQueueManager.add_to_queue")
+    def add_to_queue(self, full_path, filename, parent, target_path, status, is_archive, is_main_archive_file, media_info_cache_id, file_size=None, file_mtime_ns=None):
+        """Add the file to the work queue, or get the item it already has there (see _enqueue_query_template). Returns its id."""
+        span = trace.get_current_span()
+        if span.is_recording():
+            span.set_attributes({
+                "db.table": "work_queue",
+                "db.operation": "insert",
+                "file.path": str(full_path),
+                "file.name": str(filename),
+                "queue.status": str(status),
+            })
 
-    def _ensure_table_exists(self):
         try:
             with self._get_connection() as conn:
                 with conn.cursor() as cursor:
-                    self._logger.debug("Enabling uuid-ossp extension")
-                    cursor.execute('CREATE EXTENSION IF NOT EXISTS "uuid-ossp";')
-
-                    self._logger.debug("Creating work_queue table if it does not exist")
-                    create_table_query = """
-                                         CREATE TABLE IF NOT EXISTS work_queue (
-                                             id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
-                                             full_path TEXT NOT NULL,
-                                             filename TEXT NOT NULL,
-                                             parent TEXT NOT NULL,
-                                             target_path TEXT NULL,
-                                             status TEXT NOT NULL,
-                                             is_archive BOOLEAN NOT NULL DEFAULT FALSE,
-                                             is_main_archive_file BOOLEAN NOT NULL DEFAULT FALSE,
-                                             created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                                             modified_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                                             media_info_cache_id UUID NULL);"""
-                    cursor.execute(create_table_query)
-
-                    self._logger.debug("Creating batch_control table if it does not exist")
-                    create_table_query = """
-                                         CREATE TABLE IF NOT EXISTS batch_control (
-                                             batch_id UUID NOT NULL,
-                                             work_queue_id UUID NOT NULL,
-                                             in_progress BOOLEAN NOT NULL DEFAULT FALSE,
-                                             verified BOOLEAN NOT NULL DEFAULT FALSE,
-                                             created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                                             modified_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
-                                         );"""
-                    cursor.execute(create_table_query)
-
+                    _enqueue_item.execute(cursor, (full_path, filename, parent, target_path, status, is_archive, is_main_archive_file, media_info_cache_id, file_size, file_mtime_ns))
+                    row = cursor.fetchone()
+                    if row is not None and row[2]:
+                        self._notify_work_available(cursor)
                     conn.commit()
+                    if row is not None:
+                        if not row[2]:
+                            self._logger.debug(f"{full_path} is already in the work queue, as [{row[1]}].")
+                        return row[1]
+
+                    raise RuntimeError(f"Error adding {full_path} to the work queue: No row returned from the database")
         except psycopg2.Error as e:
-            error_message = f"Error creating the work queue table: {str(e)}"
+            error_message = f"Error adding {full_path} to the work queue: {str(e)}"
             self._logger.error(error_message)
             raise RuntimeError(error_message) from e
 
-    @_activity_tracker.trace("WorkQueueManager.add_to_queue")
-    def add_to_queue(self, full_path, filename, parent, target_path, status, is_archive, is_main_archive_file, media_info_cache_id):
+    @_activity_tracker.trace("WorkQueueManager.add_many_to_queue")
+    def add_many_to_queue(self, items):
+        """
+        Add several files to the work queue with a single multi-row INSERT, in one transaction.
+
+        `items` are dicts with the arguments of add_to_queue. Files already in the queue are not added
+        again (see _enqueue_query_template). Returns the id of each item, new or existing, in the same order.
+        """
         span = trace.get_current_span()
         if span.is_recording():
             span.set_attributes({
                 "db.table": "work_queue",
                 "db.operation": "insert",
-                "file.path": str(full_path),
-                "file.name": str(filename),
-                "queue.status": str(status),
+                "work_items.count": len(items),
             })
 
+        if len(items) == 0:
+            return []
+
+        # The same path twice in one INSERT ... ON CONFLICT DO UPDATE is an error: the last one wins.
+        unique_items = {item['full_path']: item for item in items}
+
         try:
             with self._get_connection() as conn:
                 with conn.cursor() as cursor:
-                    insert_query = """INSERT INTO work_queue (full_path, filename, parent, target_path, status, is_archive, is_main_archive_file, media_info_cache_id)
-                                      VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                                      returning id"""
-                    cursor.execute(insert_query, (full_path, filename, parent, target_path, status, is_archive, is_main_archive_file, media_info_cache_id))
+                    rows = execute_values(
+                        cursor,
+                        _enqueue_query_template.format(values="%s"),
+                        [tuple(item.get(column) for column in _enqueue_columns) for item in unique_items.values()],
+                        template=f"({', '.join(f'%s::{column_type}' for column_type in _enqueue_types)})",
+                        page_size=len(unique_items),
+                        fetch=True,
+                    )
+                    added_pending = sum(1 for row in rows if row[2])
+                    if added_pending > 0:
+                        self._notify_work_available(cursor)
                     conn.commit()
-                    row = cursor.fetchone()
-                    if row is not None:
-                        return row[0]
 
-                    raise RuntimeError(f"Error adding {full_path} to the work queue: No row returned from the database")
+            ids = {row[0]: row[1] for row in rows}
+            missing = [full_path for full_path in unique_items if full_path not in ids]
+            if len(missing) > 0:
+                raise RuntimeError(f"Error adding {len(items)} files to the work queue: no row returned for {missing}")
+
+            if span.is_recording():
+                span.set_attribute("work_items.added_pending", added_pending)
+
+            return [ids[item['full_path']] for item in items]
+
         except psycopg2.Error as e:
-            error_message = f"Error adding {full_path} to the work queue: {str(e)}"
+            error_message = f"Error adding {len(items)} files to the work queue: {str(e)}"
             self._logger.error(error_message)
             raise RuntimeError(error_message) from e
 
@@ -106,6 +355,12 @@ class WorkQueueManager(BaseRepository):
                     self._logger.debug(f"Updating work item [{work_item_id}]. Full path: {full_path}, target path: {target_path}, status: {status}")
 
                     keys = [key for key in work_item.keys() if key not in ['id', 'created_at', 'modified_at']]
+                    if set(keys) == set(_update_item_columns):
+                        # A whole work item, as read from the database: the usual case.
+                        _update_item.execute(cursor, [work_item[key] for key in _update_item_columns] + [work_item_id])
+                        conn.commit()
+                        return
+
                     values = []
                     fields = []
 
@@ -123,53 +378,110 @@ class WorkQueueManager(BaseRepository):
             self._logger.error(error_message)
             raise RuntimeError(error_message) from e
 
+    @_activity_tracker.trace("WorkQueueManager.update_many")
+    def update_many(self, changes):
+        """
+        Write the changes of several work items in one transaction.
+
+        `changes` is a list of (work item id, {column: value}). Items changing the same set of
+        columns are written together, with a single UPDATE ... FROM (VALUES ...).
+        """
+        span = trace.get_current_span()
+        groups = {}
+        for work_item_id, fields in changes:
+            if len(fields) == 0:
+                continue
+            columns = tuple(sorted(fields.keys()))
+            groups.setdefault(columns, []).append((work_item_id, fields))
+
+        if span.is_recording():
+            span.set_attributes({
+                "db.table": "work_queue",
+                "db.operation": "update",
+                "work_items.count": len(changes),
+                "work_items.statements": len(groups),
+            })
+
+        if len(groups) == 0:
+            return
+
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    for columns, items in groups.items():
+                        set_clause = ", ".join(f"{column} = v.{column}" for column in columns)
+                        casts = ", ".join(
+                            f"%s::{_work_item_column_types[column]}" if column in _work_item_column_types else "%s"
+                            for column in columns
+                        )
+                        update_query = f"""UPDATE work_queue AS w
+                                           SET {set_clause}, modified_at = CURRENT_TIMESTAMP
+                                           FROM (VALUES %s) AS v (id, {", ".join(columns)})
+                                           WHERE w.id = v.id"""
+                        execute_values(
+                            cursor,
+                            update_query,
+                            [(str(work_item_id), *(fields[column] for column in columns)) for work_item_id, fields in items],
+                            template=f"(%s::uuid, {casts})",
+                            page_size=len(items),
+                        )
+                    conn.commit()
+        except psycopg2.Error as e:
+            error_message = f"Error updating {len(changes)} work items: {str(e)}"
+            self._logger.error(error_message)
+            raise RuntimeError(error_message) from e
+
+    def unit_of_work(self):
+        return WorkItemUnitOfWork(self)
+
     @_activity_tracker.trace("WorkQueueManager.get_next_batch")
-    def get_next_batch(self, batch_id=None, force_new_batch=False):
+    def get_next_batch(self, force_new_batch=False, max_batch_size=None, max_batch_age_seconds=0):
+        """
+        Claim a new batch of PENDING items, even if earlier batches are still running.
+
+        A batch is only cut when there are at least `max_batch_size` items waiting,
+        or when the oldest waiting item is at least `max_batch_age_seconds` old.
+        This gives late arrivals a few seconds to join the same batch (and the same
+        completion notification), without waiting for any running batch to finish.
+        `force_new_batch` claims whatever is PENDING right away.
+        """
         span = trace.get_current_span()
         if span.is_recording():
             span.set_attributes({
                 "db.table": "work_queue",
                 "db.operation": "select_and_update",
-                "batch.id": str(batch_id or ""),
                 "batch.force_new": force_new_batch,
+                "batch.max_size": max_batch_size or 0,
+                "batch.max_age_seconds": max_batch_age_seconds or 0,
             })
 
         try:
             with self._get_connection() as conn:
                 with conn.cursor() as cursor:
-                    select_query = "SELECT * FROM batch_control WHERE in_progress = TRUE"
-                    cursor.execute(select_query)
-                    row = cursor.fetchone()
+                    if not force_new_batch:
+                        _count_due_items.execute(cursor, (max_batch_age_seconds or 0, max_batch_size))
+                        pending_count, is_oldest_due = cursor.fetchone()
+                        conn.commit()
 
-                    if row is not None and not force_new_batch:
-                        self._logger.debug(f"Batch [{batch_id}] is already in progress. Returning empty batch...")
-                        return [], batch_id
+                        if pending_count == 0:
+                            return [], None
 
-                    update_and_select_query = """
-                                              UPDATE work_queue
-                                              SET status = 'WORKING',
-                                                  modified_at = CURRENT_TIMESTAMP
-                                              WHERE status = 'PENDING'
-                                              RETURNING id, full_path, filename, parent, target_path, status, is_archive, is_main_archive_file, created_at, modified_at, media_info_cache_id"""
+                        is_full = max_batch_size is not None and pending_count >= max_batch_size
+                        if not is_full and not is_oldest_due:
+                            self._logger.debug(f"{pending_count} work items waiting, but the batch is not due yet.")
+                            return [], None
 
-                    cursor.execute(update_and_select_query)
+                    batch_id = str(uuid.uuid4())
+                    _claim_batch.execute(cursor, (_worker_id, _lease_seconds, max_batch_size, batch_id))
                     rows = cursor.fetchall()
+                    conn.commit()
 
                     if len(rows) == 0:
-                        conn.commit()
                         return [], None
 
-                    self._logger.debug(f"Found {len(rows)} work items to process. Creating a new batch...")
+                    self._logger.debug(f"Claimed {len(rows)} work items as batch [{batch_id}], leased to [{_worker_id}].")
                     batch = [self._parse_work_item_row_to_object(row) for row in rows]
 
-                    # At this point we can generate a new batch ID, because there's nothing in progress.
-                    batch_id = str(uuid.uuid4())
-
-                    for batch_item in batch:
-                        insert_query = """INSERT INTO batch_control (batch_id, work_queue_id, in_progress) VALUES (%s, %s, true)"""
-                        cursor.execute(insert_query, (batch_id, batch_item['id']))
-
-                    conn.commit()
                 return batch, batch_id
 
         except psycopg2.Error as e:
@@ -191,8 +503,7 @@ class WorkQueueManager(BaseRepository):
             with self._get_connection() as conn:
                 with conn.cursor() as cursor:
                     self._logger.debug(f"Setting batch [{batch_id}] as done...")
-                    update_query = """UPDATE batch_control SET in_progress = FALSE, modified_at = CURRENT_TIMESTAMP WHERE batch_id = %s"""
-                    cursor.execute(update_query, (batch_id,))
+                    _set_batch_as_done.execute(cursor, (batch_id,))
                     conn.commit()
 
         except psycopg2.Error as e:
@@ -202,49 +513,220 @@ class WorkQueueManager(BaseRepository):
 
     @_activity_tracker.trace("WorkQueueManager.move_working_items_back_to_pending")
     def move_working_items_back_to_pending(self, batch_id):
+        """
+        Release the WORKING items leased to this worker: the ones of the batch, or all of them when
+        `batch_id` is None. Items of other workers are never touched (see release_expired_leases).
+
+        Released items are retried after a backoff, or marked FAILED_MAX_ATTEMPTS when they are out of attempts.
+        """
         span = trace.get_current_span()
         if span.is_recording():
             span.set_attributes({
                 "db.table": "work_queue",
                 "db.operation": "update",
                 "batch.id": str(batch_id or ""),
+                "worker.id": _worker_id,
             })
 
         try:
             if batch_id is None:
-                self._logger.warning("No batch id provided. Moving all working items back to pending...")
+                self._logger.warning(f"No batch id provided. Moving all working items leased to [{_worker_id}] back to pending...")
 
             with self._get_connection() as conn:
                 with conn.cursor() as cursor:
                     self._logger.debug(f"[Batch ID: {batch_id}] Moving working items back to pending so the next back end can process them...")
-                    # TODO: Add attempt control, otherwise we might end up retrying impossibly wrong items forever.
-
-                    update_query = """UPDATE work_queue
-                                      SET status      = 'PENDING',
-                                          modified_at = CURRENT_TIMESTAMP
-                                      WHERE status = 'WORKING'"""
 
                     if batch_id is not None:
-                        update_query += """ AND id IN ( SELECT work_queue_id FROM batch_control WHERE batch_id = %s )"""
-                        cursor.execute(update_query, (batch_id,))
+                        _release_batch_items.execute(cursor, _release_params + (_worker_id, batch_id))
                     else:
-                        cursor.execute(update_query)
+                        _release_worker_items.execute(cursor, _release_params + (_worker_id,))
+
+                    rows = cursor.fetchall()
+                    statuses = [row[0] for row in rows]
+                    # Items in backoff aren't claimable yet: the batch processor wakes up for them on its own.
+                    if any(status == 'PENDING' and due for status, due in rows):
+                        self._notify_work_available(cursor)
 
                     conn.commit()
 
+            self._log_released_items(statuses, f"[Batch ID: {batch_id}] ")
+
         except psycopg2.Error as e:
             error_message = f"[Batch ID: {batch_id}] Error moving working items back to pending: {str(e)}"
             self._logger.error(error_message)
             raise RuntimeError(error_message) from e
 
+    @staticmethod
+    def add_active_batch(batch_id):
+        """Keep renewing the leases of the batch's items, until remove_active_batch is called."""
+        with _active_batch_ids_lock:
+            _active_batch_ids.add(str(batch_id))
+
+    @staticmethod
+    def remove_active_batch(batch_id):
+        """
+        Stop renewing the leases of the batch's items. Items left WORKING (e.g.: they couldn't be
+        released) are freed by release_expired_leases once their lease runs out.
+        """
+        with _active_batch_ids_lock:
+            _active_batch_ids.discard(str(batch_id))
+
+    @_activity_tracker.trace("WorkQueueManager.renew_leases")
+    def renew_leases(self):
+        """Extend the lease of the items of the batches this process is working on. Returns how many were renewed."""
+        with _active_batch_ids_lock:
+            batch_ids = list(_active_batch_ids)
+
+        if len(batch_ids) == 0:
+            return 0
+
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    _renew_leases.execute(cursor, (_lease_seconds, _worker_id, batch_ids))
+                    renewed = cursor.rowcount
+                    conn.commit()
+                    return renewed
+
+        except psycopg2.Error as e:
+            error_message = f"Error renewing the leases of [{_worker_id}]: {str(e)}"
+            self._logger.error(error_message)
+            raise RuntimeError(error_message) from e
+
+    @_activity_tracker.trace("WorkQueueManager.release_expired_leases")
+    def release_expired_leases(self):
+        """
+        Move WORKING items whose lease expired (their worker crashed, or lost the database) back to PENDING.
+
+        Items without a lease were claimed before leases existed, and are released too.
+        Returns how many items were released.
+        """
+        span = trace.get_current_span()
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    _release_expired_items.execute(cursor, _release_params)
+                    rows = cursor.fetchall()
+                    statuses = [row[0] for row in rows]
+
+                    if any(status == 'PENDING' and due for status, due in rows):
+                        self._notify_work_available(cursor)
+
+                    conn.commit()
+
+            if span.is_recording():
+                span.set_attribute("work_items.released", len(statuses))
+
+            self._log_released_items(statuses, "Expired leases: ")
+            return len(statuses)
+
+        except psycopg2.Error as e:
+            error_message = f"Error releasing expired work item leases: {str(e)}"
+            self._logger.error(error_message)
+            raise RuntimeError(error_message) from e
+
+    def _log_released_items(self, statuses, prefix):
+        given_up = statuses.count('FAILED_MAX_ATTEMPTS')
+        if given_up > 0:
+            self._logger.warning(f"{prefix}{given_up} work items used all their {_max_attempts} attempts and were marked as FAILED_MAX_ATTEMPTS.")
+
+        if len(statuses) > given_up:
+            self._logger.info(f"{prefix}{len(statuses) - given_up} work items moved back to pending, to be retried after a backoff.")
+
+    def start_lease_heartbeat(self):
+        """
+        Start (once per process) the background thread that keeps this worker's leases alive,
+        and releases the expired leases of other workers. Call it before claiming any batch.
+        """
+        global _heartbeat_thread
+        with _heartbeat_lock:
+            if _heartbeat_thread is not None and _heartbeat_thread.is_alive():
+                return
+
+            _heartbeat_thread = threading.Thread(target=self._lease_heartbeat_loop, name="smo-lease-heartbeat", daemon=True)
+            _heartbeat_thread.start()
+
+        self._logger.info(
+            f"Worker [{_worker_id}]: leases of {_lease_seconds}s, renewed every {_heartbeat_interval_seconds}s."
+        )
+
+    def _lease_heartbeat_loop(self):
+        while True:
+            try:
+                self.renew_leases()
+                self.release_expired_leases()
+            except Exception as e:
+                # Keep beating: the leases only expire if this keeps failing for a whole lease period.
+                self._logger.warning(f"Lease heartbeat of [{_worker_id}] failed: {str(e)}")
+
+            time.sleep(_heartbeat_interval_seconds)
+
+    @_activity_tracker.trace("WorkQueueManager.seconds_until_next_retry")
+    def seconds_until_next_retry(self):
+        """Seconds until the first PENDING item in backoff can be claimed, or None if none is waiting."""
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    _seconds_until_next_retry.execute(cursor)
+                    seconds = cursor.fetchone()[0]
+                    return None if seconds is None else max(0.0, float(seconds))
+
+        except psycopg2.Error as e:
+            error_message = f"Error reading when the next work item retry is due: {str(e)}"
+            self._logger.error(error_message)
+            raise RuntimeError(error_message) from e
+
+    @_activity_tracker.trace("WorkQueueManager.reset_attempts")
+    def reset_attempts(self):
+        """
+        Make the items waiting for a retry (PENDING in backoff) and the ones that used all their attempts
+        (FAILED_MAX_ATTEMPTS) claimable right away, with all their attempts again. A FAILED_MAX_ATTEMPTS
+        item is only brought back if its file isn't queued again already (the newest one, per path).
+        Returns how many items were reset.
+        """
+        span = trace.get_current_span()
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        """UPDATE work_queue
+                           SET status = 'PENDING',
+                               attempts = 0,
+                               next_attempt_at = NULL,
+                               modified_at = CURRENT_TIMESTAMP
+                           WHERE (status = 'PENDING' AND next_attempt_at IS NOT NULL)
+                              OR id IN (SELECT DISTINCT ON (f.full_path) f.id
+                                        FROM work_queue AS f
+                                        WHERE f.status = 'FAILED_MAX_ATTEMPTS'
+                                          AND NOT EXISTS (SELECT 1
+                                                          FROM work_queue AS a
+                                                          WHERE a.full_path = f.full_path
+                                                            AND a.status IN ('PENDING', 'WORKING'))
+                                        ORDER BY f.full_path, f.created_at DESC)"""
+                    )
+                    reset = cursor.rowcount
+
+                    if reset > 0:
+                        self._notify_work_available(cursor)
+
+                    conn.commit()
+
+            if span.is_recording():
+                span.set_attribute("work_items.reset", reset)
+
+            return reset
+
+        except psycopg2.Error as e:
+            error_message = f"Error resetting the attempts of the work items: {str(e)}"
+            self._logger.error(error_message)
+            raise RuntimeError(error_message) from e
+
     @_activity_tracker.trace("WorkQueueManager.get_batch_data")
     def get_batch_data(self, batch_id):
         try:
             with self._get_connection() as conn:
                 with conn.cursor() as cursor:
-                    select_query = """SELECT * FROM work_queue
-                                      WHERE id IN (SELECT work_queue_id FROM batch_control WHERE batch_id = %s)"""
-                    cursor.execute(select_query, (batch_id,))
+                    _get_batch_items.execute(cursor, (batch_id,))
                     rows = cursor.fetchall()
 
                     if len(rows) == 0:
@@ -264,11 +746,7 @@ class WorkQueueManager(BaseRepository):
             with self._get_connection() as conn:
                 with conn.cursor() as cursor:
                     self._logger.debug(f"[Batch ID: {batch_id}] Updating batch verification to {verified}...")
-                    update_query = """UPDATE batch_control
-                                      SET verified = %s,
-                                          modified_at = CURRENT_TIMESTAMP
-                                      WHERE batch_id = %s"""
-                    cursor.execute(update_query, (verified, batch_id))
+                    _update_batch_verification.execute(cursor, (verified, batch_id))
                     conn.commit()
 
         except psycopg2.Error as e:
@@ -291,6 +769,72 @@ class WorkQueueManager(BaseRepository):
             self._logger.error(error_message)
             raise RuntimeError(error_message) from e
 
+    def start_listening(self):
+        """
+        Subscribe to the work queue channel on a dedicated connection.
+
+        Call it before the first get_next_batch, so nothing that gets queued
+        between that call and wait_for_work is missed.
+        """
+        if self._listen_connection is not None and not self._listen_connection.closed:
+            return
+
+        conn = self._create_dedicated_connection()
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {_work_queue_channel};")
+
+        self._listen_connection = conn
+        self._logger.debug(f"Listening for work queue notifications on [{_work_queue_channel}].")
+
+    def wait_for_work(self, timeout_seconds):
+        """
+        Block until new work is announced or the timeout expires.
+
+        Returns True when woken up by a notification. The timeout works as a
+        safety net: callers should look for work after it either way.
+        """
+        try:
+            if self._listen_connection is None or self._listen_connection.closed:
+                # Anything sent while we were not listening is lost, so assume there's work.
+                self.start_listening()
+                return True
+
+            conn = self._listen_connection
+            if len(conn.notifies) == 0:
+                readable, _, _ = select.select([conn], [], [], timeout_seconds)
+                if len(readable) == 0:
+                    return False
+
+                conn.poll()
+
+            woken_up = len(conn.notifies) > 0
+            # Many notifications can pile up while a batch runs; one claim takes care of all of them.
+            conn.notifies.clear()
+            return woken_up
+
+        except (psycopg2.Error, OSError) as e:
+            self._logger.warning(f"Error waiting for work queue notifications. Will reconnect. Error: {str(e)}")
+            self._close_listen_connection()
+            time.sleep(min(timeout_seconds, 10))
+            return False
+
+    def _close_listen_connection(self):
+        if self._listen_connection is None:
+            return
+
+        try:
+            self._listen_connection.close()
+        except psycopg2.Error:
+            pass
+
+        self._listen_connection = None
+
+    @staticmethod
+    def _notify_work_available(cursor):
+        # Delivered to the listeners only when the surrounding transaction commits.
+        cursor.execute("SELECT pg_notify(%s, %s)", (_work_queue_channel, 'PENDING'))
+
     @staticmethod
     def _parse_work_item_row_to_object(row):
         return {
@@ -304,5 +848,67 @@ class WorkQueueManager(BaseRepository):
             "is_main_archive_file": row[7],
             "created_at": row[8],
             "modified_at": row[9],
-            "media_info_cache_id": row[10]
+            "media_info_cache_id": row[10],
+            "source_sha256": row[11],
+            "attempts": row[12],
+            "last_error": row[13],
+            "next_attempt_at": row[14],
+            "file_size": row[15],
+            "file_mtime_ns": row[16],
         }
+
+
+class WorkItemUnitOfWork:
+    """
+    Collects the changes made to work items while they are processed, and writes them together.
+
+    `update(item)` only records which fields changed since the item was last written (or tracked).
+    Nothing is written until `flush()` is called, or an update is marked as `durable`
+    (e.g.: WORKING -> DONE), which writes everything pending right away, in one transaction.
+    Several items finishing together end up in the same UPDATE ... FROM (VALUES ...).
+    Safe to share between the workers of a batch.
+    """
+
+    def __init__(self, work_queue_manager: WorkQueueManager):
+        self._work_queue_manager = work_queue_manager
+        self._written = {}
+        self._dirty = {}
+        self._lock = threading.Lock()
+
+    def track(self, items):
+        """Remember the current (already written) state of the items, so only real changes are written."""
+        with self._lock:
+            for item in items:
+                self._written[item['id']] = self._get_fields(item)
+
+    def update(self, item, durable=False):
+        with self._lock:
+            self._dirty[item['id']] = item
+
+        if durable:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if len(self._dirty) == 0:
+                return
+
+            changes = []
+            pending = {}
+            for item_id, item in self._dirty.items():
+                fields = self._get_fields(item)
+                written = self._written.get(item_id, {})
+                changed = {key: value for key, value in fields.items() if key not in written or written[key] != value}
+                if len(changed) > 0:
+                    changes.append((item_id, changed))
+                pending[item_id] = fields
+
+            if len(changes) > 0:
+                self._work_queue_manager.update_many(changes)
+
+            self._written.update(pending)
+            self._dirty.clear()
+
+    @staticmethod
+    def _get_fields(item):
+        return {key: value for key, value in item.items() if key not in _read_only_work_item_keys}
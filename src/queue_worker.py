@@ -1,18 +1,32 @@
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from queue import Queue
+from queue import Empty, Queue
 
 from opentelemetry import trace
 
 from src.data.activity_logger import ActivityTracker
-from src.tasks.check_file_is_compressed import is_compressed_file
-from src.tasks.check_if_should_copy_file import check_should_copy_file
-from src.tasks.check_is_main_file_in_archive import is_main_archive_file
+from src.tasks.classify_file import classify_file
 from src.data.work_queue_manager import WorkQueueManager
+from src.utils import get_file_fingerprint, to_int
 
 _q = Queue()
 _work_manager = WorkQueueManager()
 _activity_tracker = ActivityTracker("Queue Worker")
 
+# Events arriving close together (an archive being extracted, an rsync drop) are enqueued together:
+# the consumer keeps collecting until no new event arrives for the quiet window, or the batch is
+# full, or the first event waited the max time.
+_coalesce_quiet_seconds = max(0, to_int(os.environ.get('QUEUE_COALESCE_WINDOW_MS'), 250)) / 1000
+_coalesce_max_wait_seconds = max(0, to_int(os.environ.get('QUEUE_COALESCE_MAX_WAIT_MS'), 2000)) / 1000
+_coalesce_max_batch_size = max(1, to_int(os.environ.get('QUEUE_COALESCE_MAX_BATCH'), 200))
+_classify_executor = ThreadPoolExecutor(
+    max_workers=max(1, to_int(os.environ.get('QUEUE_CLASSIFY_WORKERS'), 4)),
+    thread_name_prefix="smo-classify",
+)
+
 
 @_activity_tracker.trace("add_to_queue")
 def add_to_queue(filename, is_directory):
@@ -31,53 +45,128 @@ def add_to_queue(filename, is_directory):
 def queue_consumer():
     tag = "[QUEUE CONSUMER]"
     while True:
-        filename, is_directory = _q.get()
+        filenames = _collect_events(tag)
+        if len(filenames) == 0:
+            continue
+
+        _activity_tracker.info(f"{tag} {len(filenames)} files created.")
+        try:
+            prepare_files_for_processing(filenames)
+        except Exception as e:
+            _activity_tracker.error(f"{tag} Error adding {len(filenames)} files to the queue: {str(e)}")
+
+
+def _collect_events(tag):
+    """Wait for the next event, then gather the ones that follow it. Returns unique file paths, in arrival order."""
+    filenames = {}
+    filename, is_directory = _q.get()
+    first_event_at = time.monotonic()
+
+    while True:
         if is_directory:
             _activity_tracker.debug(f"{tag} Ignoring directory: {filename}")
+        elif filename in filenames:
+            _activity_tracker.debug(f"{tag} Ignoring duplicated event for: {filename}")
+        else:
+            filenames[filename] = None
+
+        if len(filenames) >= _coalesce_max_batch_size:
+            break
+
+        timeout = min(_coalesce_quiet_seconds, first_event_at + _coalesce_max_wait_seconds - time.monotonic())
+        if timeout <= 0:
+            break
+
+        try:
+            filename, is_directory = _q.get(timeout=timeout)
+        except Empty:
+            break
+
+    return list(filenames)
+
+
+@_activity_tracker.trace("prepare_files_for_processing")
+def prepare_files_for_processing(filenames):
+    """Classify the files in parallel, and add them all to the work queue with a single INSERT."""
+    span = trace.get_current_span()
+    tag = "[QUEUE CONSUMER]"
+
+    # Each file is classified in a copy of the caller's context, so its span (and attributes) belong to this trace.
+    futures = [
+        _classify_executor.submit(contextvars.copy_context().run, _try_classify_file, filename)
+        for filename in filenames
+    ]
+
+    items = []
+    for filename, future in zip(filenames, futures):
+        item = future.result()
+        if item is None:
             continue
+        _activity_tracker.debug(f"{tag} Adding file [{filename}] to queue with status [{item['status']}]")
+        items.append(item)
+
+    new_queue_item_ids = _work_manager.add_many_to_queue(items)
+
+    if span.is_recording():
+        span.set_attributes({
+            "queue.files": len(filenames),
+            "queue.added": len(new_queue_item_ids),
+            "queue.pending": sum(1 for item in items if item['status'] == "PENDING"),
+        })
+
+    for item, new_queue_item_id in zip(items, new_queue_item_ids):
+        _activity_tracker.info(
+            f"{tag} Added file [{item['full_path']}] to queue "
+            f"with status [{item['status']}], and ID [{new_queue_item_id}]"
+        )
 
-        _activity_tracker.info(f"{tag} File created: {filename}")
-        prepare_file_for_processing(filename)
+    return new_queue_item_ids
 
 
-@_activity_tracker.trace("prepare_file_for_processing")
 def prepare_file_for_processing(filename):
+    """Classify a single file and add it to the work queue (see prepare_files_for_processing)."""
+    prepare_files_for_processing([filename])
+
+
+@_activity_tracker.trace("QueueWorker.try_classify_file")
+def _try_classify_file(filename):
+    try:
+        return _classify_file(filename)
+    except Exception as e:
+        # e.g.: a temporary file that was renamed or deleted right after being created.
+        _activity_tracker.warning(f"[QUEUE CONSUMER] Could not classify [{filename}], not adding it to the queue: {str(e)}")
+        return None
+
+
+def _classify_file(filename):
+    """Work out how the file should be queued. Returns the arguments for WorkQueueManager.add_to_queue."""
     span = trace.get_current_span()
-    if span.is_recording():
-        span.set_attribute("file.path", str(filename))
-
-    is_archive = is_compressed_file(filename)
-    main_archive_file = is_main_archive_file(filename) if is_archive else False
-    should_copy_file = check_should_copy_file(filename)
-    status = (
-        "IGNORED"
-        if (is_archive and not main_archive_file) or not should_copy_file
-        else "PENDING"
-    )
+    classification = classify_file(filename)
+    is_archive = classification.is_archive
+    main_archive_file = is_archive and classification.is_main_volume
+    status = classification.status
     path = Path(filename)
+    file_size, file_mtime_ns = get_file_fingerprint(filename)
 
     if span.is_recording():
         span.set_attributes({
             "file.name": path.name,
             "file.is_archive": is_archive,
             "file.is_main_archive": main_archive_file,
+            "file.archive_kind": classification.archive_kind or "",
+            "file.skip_reason": classification.skip_reason or "",
             "queue.status": status,
         })
 
-    _activity_tracker.debug(
-        f"[QUEUE CONSUMER] Adding file [{filename}] to queue with status [{status}]"
-    )
-    new_queue_item_id = _work_manager.add_to_queue(
-        full_path=filename,
-        filename=path.name,
-        parent=str(path.parent),
-        target_path=None,
-        status=status,
-        is_archive=is_archive,
-        is_main_archive_file=main_archive_file,
-        media_info_cache_id=None,
-    )
-    _activity_tracker.info(
-        f"[QUEUE CONSUMER] Added file [{filename}] to queue "
-        f"with status [{status}], and ID [{new_queue_item_id}]"
-    )
+    return {
+        "full_path": filename,
+        "filename": path.name,
+        "parent": str(path.parent),
+        "target_path": None,
+        "status": status,
+        "is_archive": is_archive,
+        "is_main_archive_file": main_archive_file,
+        "media_info_cache_id": None,
+        "file_size": file_size,
+        "file_mtime_ns": file_mtime_ns,
+    }
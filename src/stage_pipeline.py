@@ -0,0 +1,184 @@
+import contextvars
+import os
+import threading
+import time
+from queue import Queue
+from typing import Any, Callable, Optional
+
+from src.utils import to_int
+
+STABILITY_STAGE = "stability"
+IDENTIFY_STAGE = "identify"
+DECOMPRESS_STAGE = "decompress"
+COPY_STAGE = "copy"
+
+_stop = object()
+
+
+def get_stage_limits_from_env() -> dict[str, int]:
+    """
+    Read how many workers each processing stage gets in the parallel execution mode.
+
+    - Identification is network-bound, so it can have several calls in flight.
+    - Decompression is CPU-bound, so it should not go beyond the number of cores.
+    - Copy is IO-bound, and more than a couple of writers per disk only adds seeking.
+    """
+    return {
+        IDENTIFY_STAGE: max(1, to_int(os.environ.get("BATCH_IDENTIFY_WORKERS"), 4)),
+        DECOMPRESS_STAGE: max(1, to_int(os.environ.get("BATCH_DECOMPRESS_WORKERS"), 1)),
+        COPY_STAGE: max(1, to_int(os.environ.get("BATCH_COPY_WORKERS"), 2)),
+    }
+
+
+def get_stage_queue_size_from_env() -> int:
+    return max(1, to_int(os.environ.get("BATCH_STAGE_QUEUE_SIZE"), 8))
+
+
+class StageStats:
+    """Throughput and queue-depth counters for one stage of the pipeline."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._started_at = time.monotonic()
+        self._processed = 0
+        self._failed = 0
+        self._busy_seconds = 0.0
+        self._max_queue_depth = 0
+
+    def record(self, elapsed_seconds: float, failed: bool = False):
+        with self._lock:
+            self._processed += 1
+            self._busy_seconds += elapsed_seconds
+            if failed:
+                self._failed += 1
+
+    def observe_queue_depth(self, depth: int):
+        with self._lock:
+            if depth > self._max_queue_depth:
+                self._max_queue_depth = depth
+
+    def snapshot(self, queue_depth: int = 0) -> dict:
+        with self._lock:
+            elapsed = max(time.monotonic() - self._started_at, 1e-9)
+            return {
+                "stage": self.name,
+                "processed": self._processed,
+                "failed": self._failed,
+                "busy_seconds": round(self._busy_seconds, 3),
+                "items_per_minute": round(self._processed / elapsed * 60, 2),
+                "queue_depth": queue_depth,
+                "max_queue_depth": self._max_queue_depth,
+            }
+
+
+class Stage:
+    """
+    One step of the pipeline: a bounded input queue and a fixed number of workers.
+
+    The handler receives an item and returns ``(next_stage_name, value)``.
+    When ``next_stage_name`` is None, the item is finished and ``value`` is its result.
+    """
+
+    def __init__(self, name: str, handler: Callable[[Any], tuple[Optional[str], Any]], workers: int, queue_size: int):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.queue: Queue = Queue(maxsize=queue_size)
+        self.stats = StageStats(name)
+
+
+class StagePipeline:
+    """
+    Runs items through stages connected by bounded queues.
+
+    Every stage has its own workers, so the network, CPU and disks can be busy
+    at the same time with different items. When a stage falls behind, its queue
+    fills up and the stage before it blocks (backpressure), instead of piling up
+    work in memory.
+    """
+
+    def __init__(self, stages: list[Stage], on_error: Callable[[Any, Exception], Any]):
+        self._stages = {stage.name: stage for stage in stages}
+        self._on_error = on_error
+        self._results = []
+        self._in_flight = 0
+        self._idle = threading.Condition()
+        self._threads: list[threading.Thread] = []
+
+    def start(self):
+        for stage in self._stages.values():
+            for index in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._work, args=(stage,), name=f"smo-{stage.name}-{index}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, stage_name: str, item):
+        """Queue an item into a stage. Blocks while that stage's queue is full."""
+        with self._idle:
+            self._in_flight += 1
+
+        # Carry the caller's context, so spans created by the workers keep their parent.
+        self._put(self._stages[stage_name], contextvars.copy_context(), item)
+
+    def join(self) -> list:
+        """Wait for every submitted item to finish, stop the workers and return the non-None results."""
+        with self._idle:
+            while self._in_flight > 0:
+                self._idle.wait()
+
+        for stage in self._stages.values():
+            for _ in range(stage.workers):
+                stage.queue.put(_stop)
+
+        for thread in self._threads:
+            thread.join()
+
+        self._threads.clear()
+        return list(self._results)
+
+    def stats(self) -> list[dict]:
+        return [stage.stats.snapshot(stage.queue.qsize()) for stage in self._stages.values()]
+
+    def _put(self, stage: Stage, ctx: contextvars.Context, item):
+        stage.queue.put((ctx, item))
+        stage.stats.observe_queue_depth(stage.queue.qsize())
+
+    def _work(self, stage: Stage):
+        while True:
+            entry = stage.queue.get()
+            if entry is _stop:
+                return
+
+            ctx, item = entry
+            start = time.monotonic()
+            try:
+                next_stage_name, value = ctx.run(stage.handler, item)
+            except Exception as e:
+                stage.stats.record(time.monotonic() - start, failed=True)
+                try:
+                    result = ctx.run(self._on_error, item, e)
+                except Exception:
+                    # Never let a failing error handler kill the worker and hang join().
+                    result = None
+                self._finish(result)
+                continue
+
+            stage.stats.record(time.monotonic() - start)
+
+            if next_stage_name is None:
+                self._finish(value)
+                continue
+
+            self._put(self._stages[next_stage_name], ctx, value)
+
+    def _finish(self, result):
+        with self._idle:
+            if result is not None:
+                self._results.append(result)
+
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._idle.notify_all()
@@ -1,12 +1,81 @@
 import os
+import threading
 import time
+from collections import OrderedDict
 
 from opentelemetry import trace
 
-from src.utils import get_otel_log_handler
+from src.utils import get_otel_log_handler, to_int
 
 _logger = get_otel_log_handler("Check File Stability", unique_handler_types=True)
 
+# By default, wait 3 minutes for the file to become stable, checking every 6 seconds
+_max_time_to_wait_in_seconds = 3 * 60
+_max_stable_checks = 30
+_delay_between_checks = _max_time_to_wait_in_seconds / _max_stable_checks
+_stable_checks_required = 3
+
+
+class FileStabilityRegistry:
+    """
+    Keeps track of the write/close events reported by the file system watcher.
+
+    A file that was closed after being written, and was not modified again for
+    `quiet_window_seconds`, is considered stable without any size polling.
+    On file systems that do not report close events, nothing is ever recorded
+    here and the callers fall back to polling.
+    """
+
+    def __init__(self, quiet_window_seconds: float, max_entries: int = 10000):
+        self._quiet_window_seconds = quiet_window_seconds
+        self._max_entries = max_entries
+        self._entries: OrderedDict[str, list] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record_modified(self, path):
+        self._record(path, 1)
+
+    def record_closed(self, path):
+        self._record(path, 0)
+
+    def is_stable(self, path) -> bool:
+        key = os.path.normpath(str(path))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            last_closed_at, last_modified_at = entry
+
+        if last_closed_at is None:
+            return False
+
+        if last_modified_at is not None and last_modified_at > last_closed_at:
+            # Written again after the last close: someone is still working on it.
+            return False
+
+        return time.monotonic() - last_closed_at >= self._quiet_window_seconds
+
+    def _record(self, path, slot):
+        key = os.path.normpath(str(path))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = [None, None]
+                self._entries[key] = entry
+            else:
+                self._entries.move_to_end(key)
+
+            entry[slot] = now
+
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+
+stability_registry = FileStabilityRegistry(
+    quiet_window_seconds=to_int(os.environ.get("WATCHDOG_CLOSE_QUIET_SECONDS"), 5)
+)
+
 
 @_logger.trace("check_is_file_stable")
 def check_is_file_stable(filename):
@@ -14,25 +83,26 @@ def check_is_file_stable(filename):
     if span.is_recording():
         span.set_attribute("file.path", str(filename))
 
-    # By default, wait 3 minutes for the file to become stable, checking every 6 seconds
-    max_time_to_wait_in_seconds = 3 * 60
-    max_stable_checks = 30
-    delay_between_checks = max_time_to_wait_in_seconds / max_stable_checks
-    stable_checks_required = 3
-
     try:
         if not os.path.exists(filename):
             return False
 
+        if stability_registry.is_stable(filename):
+            _logger.debug(f"File was closed after writing and is quiet: {filename}")
+            return True
+
         previous_size = os.path.getsize(filename)
         stable_checks = 0
 
-        for _ in range(max_stable_checks):
-            time.sleep(delay_between_checks)
+        for _ in range(_max_stable_checks):
+            time.sleep(_delay_between_checks)
 
             if not os.path.exists(filename):
                 return False
 
+            if stability_registry.is_stable(filename):
+                return True
+
             current_size = os.path.getsize(filename)
 
             if current_size == previous_size:
@@ -41,10 +111,10 @@ def check_is_file_stable(filename):
                 stable_checks = 0
                 previous_size = current_size
 
-            if stable_checks == stable_checks_required:
+            if stable_checks == _stable_checks_required:
                 return True
 
-        return stable_checks == stable_checks_required
+        return stable_checks == _stable_checks_required
 
     except (OSError, IOError) as e:
         _logger.error(
@@ -52,3 +122,87 @@ def check_is_file_stable(filename):
             f"Assuming it is not stable. File: {str(e)}"
         )
         return False
+
+
+def iter_stable_files(items, get_filename=lambda item: item):
+    """
+    Watch every item of a batch in a single polling loop.
+
+    Each tick does one stat sweep over the items that are still being watched,
+    and yields ``(item, is_stable)`` as soon as an item's fate is known, so the
+    caller can start working on it while the others are still being checked.
+    The total wait grows with the slowest file, not with the number of files.
+
+    Time spent by the caller between two yields counts towards the delay of the
+    next tick, so slow processing does not add extra sleeping on top.
+
+    Files that the stability registry already knows to be closed and quiet are
+    yielded right away, without waiting for the size checks.
+    """
+    _logger.debug(f"Watching {len(items)} files for stability.")
+
+    watched = {}
+    for index, item in enumerate(items):
+        filename = get_filename(item)
+        size = _get_size_or_none(filename)
+        if size is None:
+            yield item, False
+            continue
+        if stability_registry.is_stable(filename):
+            yield item, True
+            continue
+        watched[index] = [item, size, 0]
+
+    last_sweep = time.monotonic()
+
+    for _ in range(_max_stable_checks):
+        if len(watched) == 0:
+            return
+
+        remaining_delay = _delay_between_checks - (time.monotonic() - last_sweep)
+        if remaining_delay > 0:
+            time.sleep(remaining_delay)
+
+        last_sweep = time.monotonic()
+        stable_now = []
+        gone = []
+
+        for index, state in watched.items():
+            item, previous_size, stable_checks = state
+            filename = get_filename(item)
+            current_size = _get_size_or_none(filename)
+
+            if current_size is None:
+                gone.append(index)
+                continue
+
+            if stability_registry.is_stable(filename):
+                stable_now.append(index)
+                continue
+
+            if current_size == previous_size:
+                state[2] = stable_checks + 1
+            else:
+                state[1] = current_size
+                state[2] = 0
+
+            if state[2] == _stable_checks_required:
+                stable_now.append(index)
+
+        # Yield only after the sweep, so every file is stat'ed once per tick.
+        for index in gone:
+            yield watched.pop(index)[0], False
+
+        for index in stable_now:
+            yield watched.pop(index)[0], True
+
+    for item, _, _ in watched.values():
+        _logger.debug(f"File did not become stable in time: {get_filename(item)}")
+        yield item, False
+
+
+def _get_size_or_none(filename):
+    try:
+        return os.path.getsize(filename)
+    except (OSError, IOError):
+        return None
@@ -1,20 +1,6 @@
-from pathlib import Path
-
-_extensions_to_skip = [
-    "sh", "bat", "ps1", "py", "js", "rb", "pl", "php", "lua",
-    "exe", "dll", "bin", "so", "out",
-
-]
+from src.tasks.classify_file import SKIP_EXTENSION, SKIP_SAMPLE, classify_filename
 
 
 def check_should_copy_file(filename):
-    if "sample" in filename.lower():
-        # We don't care about files that contain "sample" in the name
-        return False
-
-    path = Path(filename)
-
-    if path.suffix.lower().replace(".", "") in _extensions_to_skip:
-        return False
-
-    return True
+    # We don't care about samples, nor scripts/executables (see skip_name_contains and skip_extensions in the rules)
+    return classify_filename(filename).skip_reason not in (SKIP_SAMPLE, SKIP_EXTENSION)
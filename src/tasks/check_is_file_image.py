@@ -1,8 +1,8 @@
 import os
 
-from PIL import Image, UnidentifiedImageError
 from opentelemetry import trace
 
+from src.tasks.sniff_file_header import IMAGE_KINDS, sniff_file
 from src.utils import get_otel_log_handler
 
 _img_extensions = [
@@ -21,10 +21,12 @@ def is_image_file(path: str) -> bool:
     if not os.path.isfile(path):
         return False
 
-    try:
-        with Image.open(path) as img:
-            img.verify()
-        return True
-    except (ImportError, UnidentifiedImageError, OSError) as e:
-        _logger.debug(f"Error verifying image file [{path}]: {str(e)}")
-        return any(path.endswith(ext) for ext in _img_extensions)
+    # Only the signature is checked, the image is not decoded. Unknown or unreadable files fall back to the extension.
+    kind = sniff_file(path)
+    if span.is_recording():
+        span.set_attribute("file.kind", kind or "")
+
+    if kind is not None:
+        return kind in IMAGE_KINDS
+
+    return any(path.endswith(ext) for ext in _img_extensions)
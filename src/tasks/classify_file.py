@@ -0,0 +1,181 @@
+"""
+Classification of the files detected in the watch folder: is it an archive, is it the volume to
+decompress, should it be skipped.
+
+The rules (archive extensions, multi-volume name patterns, skipped paths and extensions) are read
+from a JSON file once, at import: `classification_rules.json` next to this module, or the file set
+in CLASSIFICATION_RULES_FILE. The volume patterns are compiled into a single regex, and extensions
+are looked up in dicts/sets, so classifying a name is one regex search plus a couple of lookups.
+
+Volume patterns are regexes matched against the lowercase file name. Each one needs a `volume`
+group (the volume number), and either an `extension` group (the archive extension inside the name,
+e.g. `tar.gz` in `foo.part2.tar.gz`) or a `kind`. Any name matching a volume pattern is a secondary
+volume, never decompressed on its own. Patterns must start with a dot (`\\.`), and are only tried
+from the dots of the volume suffix: at most an archive extension plus one more dot-separated part
+(e.g. `.part02.tar.gz`, `.tar.gz.003`).
+"""
+import json
+import os
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from src.tasks.sniff_file_header import ARCHIVE_KINDS, sniff_file
+from src.utils import get_env
+
+SKIP_SAMPLE = "sample"
+SKIP_EXTENSION = "extension"
+SKIP_NOT_MAIN_ARCHIVE = "not_main_archive"
+
+_default_rules_file = Path(__file__).with_name("classification_rules.json")
+
+@dataclass(frozen=True)
+class FileClassification:
+    archive_kind: Optional[str] = None
+    # Only the main volume of an archive is decompressed; the other volumes are read through it.
+    is_main_volume: bool = False
+    # Volume number as written in the name (e.g.: 0 for foo.r00, 2 for foo.part02.rar), for secondary volumes.
+    volume_index: Optional[int] = None
+    # Why the file is not processed (SKIP_* constants), or None.
+    skip_reason: Optional[str] = None
+
+    @property
+    def is_archive(self) -> bool:
+        return self.archive_kind is not None
+
+    @property
+    def status(self) -> str:
+        """Status of the file in the work queue."""
+        return "IGNORED" if self.skip_reason is not None else "PENDING"
+
+
+class ClassificationEngine:
+    def __init__(self, rules: dict):
+        self._archive_extensions = {extension.lower(): kind for extension, kind in rules.get("archive_extensions", {}).items()}
+        self._max_extension_parts = max((extension.count(".") for extension in self._archive_extensions), default=0)
+        self._main_volume_extensions = frozenset(extension.lower() for extension in rules.get("main_volume_extensions", []))
+        self._skip_name_contains = tuple(text.lower() for text in rules.get("skip_name_contains", []))
+        self._skip_extensions = frozenset(extension.lower() for extension in rules.get("skip_extensions", []))
+
+        # One alternative per volume pattern, with its groups renamed so they don't clash.
+        self._volume_rules = {}
+        alternatives = []
+        for index, rule in enumerate(rules.get("volume_patterns", [])):
+            pattern = rule["pattern"]
+            kind = rule.get("kind")
+            if not pattern.startswith(r"\."):
+                raise ValueError(f"Volume pattern [{pattern}] doesn't start with a dot")
+            if "(?P<volume>" not in pattern:
+                raise ValueError(f"Volume pattern [{pattern}] has no 'volume' group")
+            if kind is None and "(?P<extension>" not in pattern:
+                raise ValueError(f"Volume pattern [{pattern}] has neither an 'extension' group nor a 'kind'")
+
+            pattern = pattern.replace("(?P<volume>", f"(?P<volume_{index}>").replace("(?P<extension>", f"(?P<extension_{index}>")
+            alternatives.append(f"(?P<rule_{index}>{pattern})")
+            self._volume_rules[f"rule_{index}"] = (f"volume_{index}", f"extension_{index}", kind)
+
+        self._volume_regex = re.compile("|".join(alternatives)) if len(alternatives) > 0 else None
+        # Results are immutable and only a handful are distinct, so the same instances are handed out again.
+        self._classifications = {}
+
+    def classify_name(self, filename: str) -> FileClassification:
+        """Classify a file from its name alone."""
+        name = os.path.basename(filename).lower()
+        archive_kind = None
+        is_main_volume = False
+        volume_index = None
+
+        match = self._match_volume(name)
+        if match is not None:
+            volume_group, extension_group, kind = self._volume_rules[match.lastgroup]
+            volume_index = int(match.group(volume_group))
+            archive_kind = kind or self._archive_extensions.get(f".{match.group(extension_group)}", match.group(extension_group))
+        else:
+            parts = name.rsplit(".", self._max_extension_parts)
+            for count in range(len(parts) - 1, 0, -1):
+                extension = "." + ".".join(parts[-count:])
+                archive_kind = self._archive_extensions.get(extension)
+                if archive_kind is not None:
+                    is_main_volume = extension in self._main_volume_extensions
+                    break
+
+        return self._classification(archive_kind, is_main_volume, volume_index, self._skip_reason(filename, archive_kind, is_main_volume))
+
+    def classify(self, path: str) -> FileClassification:
+        """
+        Classify a file on disk. Files whose name doesn't look like an archive are checked for
+        archive signatures (see sniff_file_header); those are never the main volume (the name is
+        what tells which one it is). A path that isn't a file is never an archive.
+        """
+        classification = self.classify_name(path)
+        if classification.is_archive:
+            if os.path.isfile(path):
+                return classification
+            return self._classification(None, False, None, self._skip_reason(path, None, False))
+
+        archive_kind = sniff_file(path)
+        if archive_kind not in ARCHIVE_KINDS:
+            return classification
+
+        return self._classification(archive_kind, False, None, self._skip_reason(path, archive_kind, False))
+
+    def _match_volume(self, name: str):
+        if self._volume_regex is None:
+            return None
+
+        # Leftmost dot first, like a regex search would: ".tar.gz.003" is a tar.gz volume, not a gzip one.
+        dots = []
+        dot = len(name)
+        for _ in range(self._max_extension_parts + 1):
+            dot = name.rfind(".", 0, dot)
+            if dot < 0:
+                break
+            dots.append(dot)
+
+        for dot in reversed(dots):
+            match = self._volume_regex.match(name, dot)
+            if match is not None:
+                return match
+        return None
+
+    def _classification(self, archive_kind, is_main_volume, volume_index, skip_reason) -> FileClassification:
+        key = (archive_kind, is_main_volume, volume_index, skip_reason)
+        classification = self._classifications.get(key)
+        if classification is None:
+            classification = self._classifications.setdefault(key, FileClassification(*key))
+        return classification
+
+    def _skip_reason(self, path: str, archive_kind: Optional[str], is_main_volume: bool) -> Optional[str]:
+        # The whole path, like the folders scene releases keep their samples in (e.g.: Release/Sample/abc.mkv).
+        lower_path = str(path).lower()
+        for text in self._skip_name_contains:
+            if text in lower_path:
+                return SKIP_SAMPLE
+        name = os.path.basename(lower_path)
+        dot = name.rfind(".")
+        if dot >= 0 and name[dot:] in self._skip_extensions:
+            return SKIP_EXTENSION
+        if archive_kind is not None and not is_main_volume:
+            return SKIP_NOT_MAIN_ARCHIVE
+        return None
+
+
+def load_classification_rules(rules_file) -> dict:
+    try:
+        with open(rules_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        error_message = f"Error loading the file classification rules from [{rules_file}]: {str(e)}"
+        raise RuntimeError(error_message) from e
+
+
+_engine = ClassificationEngine(load_classification_rules(get_env("CLASSIFICATION_RULES_FILE") or _default_rules_file))
+
+
+def classify_file(path: str) -> FileClassification:
+    return _engine.classify(path)
+
+
+def classify_filename(filename: str) -> FileClassification:
+    return _engine.classify_name(filename)
@@ -1,5 +1,7 @@
+import hashlib
 import os
 import subprocess
+import tempfile
 import time
 from pathlib import Path
 import shutil
@@ -9,10 +11,27 @@ from opentelemetry import trace
 from src.utils import to_bool_env, get_otel_log_handler
 
 _logger = get_otel_log_handler("Copy File", unique_handler_types=True)
+_copy_buffer_size = 8 * 1024 * 1024
+
+# FICLONE ioctl, from linux/fs.h. Only available where fcntl exists (not on Windows).
+try:
+    import fcntl
+    _ficlone = getattr(fcntl, "FICLONE", 0x40049409)
+except ImportError:
+    fcntl = None
+    _ficlone = None
 
 
 @_logger.trace("copy_file")
 def copy_file(src_file, dst_path_str):
+    """
+    Copy the file into the destination folder.
+
+    Returns a tuple: (success, source SHA-256). The hash is computed while the
+    bytes go through the copy buffer, so the source doesn't have to be read
+    again to verify the copy. It is None when no bytes went through this process
+    (reflink, hardlink, rsync and kernel copy).
+    """
     span = trace.get_current_span()
     src_path = Path(src_file)
     dst_path = Path(dst_path_str)
@@ -31,7 +50,7 @@ def copy_file(src_file, dst_path_str):
 
     if not src_path.exists():
         _logger.warning(f"Source file {src_file} does not exist. Will not copy.")
-        return False
+        return False, None
 
     if not dst_path.exists():
         dst_path.mkdir(parents=True, exist_ok=True)
@@ -42,13 +61,13 @@ def copy_file(src_file, dst_path_str):
         try:
             _logger.debug(f"Copying file [{src_path.name}] to [{dst_path}]")
 
-            _copy_file(src_file, dst_file, copy_using_rsync)
+            source_sha256 = _copy_file(src_file, dst_file, copy_using_rsync)
 
             if change_ownership:
                 # Will fail if the script is not run as root.
                 _change_destination_ownership(dst_file, src_file)
 
-            return True
+            return True, source_sha256
         except Exception as e:
             _logger.warning(
                 f"Error copying file [{src_file}] to [{dst_path}]: {str(e)}"
@@ -58,40 +77,196 @@ def copy_file(src_file, dst_path_str):
 
             time.sleep(delay_seconds)
 
-    return False
+    return False, None
 
 
 @_logger.trace("_copy_file")
 def _copy_file(src_file, dst_path_str, copy_using_rsync):
     span = trace.get_current_span()
-    copy_method = "rsync" if copy_using_rsync else "shutil"
+
+    strategy, source_sha256 = _copy_using_best_strategy(src_file, dst_path_str, copy_using_rsync)
 
     if span.is_recording():
-        span.set_attributes({"copy.method": copy_method})
+        span.set_attributes({
+            "copy.strategy": strategy,
+            "copy.source_sha256_computed": source_sha256 is not None,
+        })
+
+    _logger.debug(f"Copied [{src_file}] using strategy [{strategy}]")
+    return source_sha256
+
+
+def _copy_using_best_strategy(src_file, dst_file, copy_using_rsync):
+    """
+    Copy the file with the cheapest strategy that works for this pair of paths.
+
+    In order:
+    1. reflink (FICLONE): the destination shares the source's extents (btrfs, XFS). No data is copied.
+    2. hardlink: only if WATCHDOG_COPY_ALLOW_HARDLINK is enabled. Both paths become the same file.
+    3. rsync: only if WATCHDOG_COPY_USING_RSYNC is enabled.
+    4. kernel copy (copy_file_range, or sendfile): the bytes never go through Python's buffers, so no
+       hash is computed and the verification reads the source. Reading the chunks back to hash them
+       would move as many bytes as a userspace copy (over the network, when the copy is done
+       server-side on NFS 4.2/SMB).
+    5. userspace copy through our own buffer.
+
+    Returns a tuple: (strategy name, source SHA-256 or None).
+    """
+    zero_copy = to_bool_env("WATCHDOG_COPY_ZERO_COPY", True)
+    allow_hardlink = to_bool_env("WATCHDOG_COPY_ALLOW_HARDLINK", False)
+
+    if os.path.exists(dst_file) and os.path.samefile(src_file, dst_file):
+        if allow_hardlink:
+            return "hardlink", None
+        # Left over by an earlier hardlink copy. Writing to it would truncate the source.
+        os.unlink(dst_file)
+
+    if zero_copy:
+        if _try_reflink(src_file, dst_file):
+            shutil.copymode(src_file, dst_file)
+            return "reflink", None
+
+        if allow_hardlink and _try_hardlink(src_file, dst_file):
+            return "hardlink", None
 
     if copy_using_rsync:
-        cmd = [
-            "rsync",
-            "-a", "--info=progress2", "--human-readable",
-            "--partial", "--append-verify", "--stats",
-            "--xattrs", "--acls",
-            src_file, dst_path_str,
-        ]
-        with subprocess.Popen(
-            cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
-        ) as p:
-            for line in p.stdout:
-                _logger.debug(line.rstrip())
-
-            exit_code = p.wait()
-            success = exit_code == 0
-
-            _logger.debug(f"rsync exit code: {exit_code} / Success: {success}")
-            if not success:
-                raise Exception("Failed to copy file using rsync")
-
-    else:
-        shutil.copy(src_file, dst_path_str)
+        _copy_using_rsync(src_file, dst_file)
+        return "rsync", None
+
+    if zero_copy and _kernel_copy_function is not None:
+        try:
+            _kernel_copy(src_file, dst_file)
+            shutil.copymode(src_file, dst_file)
+            return _kernel_copy_strategy, None
+        except OSError as e:
+            _logger.debug(f"Kernel copy not possible for [{src_file}], falling back to userspace: {str(e)}")
+
+    source_sha256 = _copy_and_hash(src_file, dst_file)
+    # Same as shutil.copy: the destination gets the source's permission bits.
+    shutil.copymode(src_file, dst_file)
+    return "userspace", source_sha256
+
+
+def _try_reflink(src_file, dst_file):
+    """
+    Clone the source into a temporary file next to the destination, and move it into place only once
+    the clone worked: a destination left by an interrupted copy stays untouched for rsync to resume.
+    """
+    if _ficlone is None:
+        return False
+
+    dst_folder, dst_name = os.path.split(os.path.abspath(dst_file))
+    try:
+        fd, tmp_file = tempfile.mkstemp(dir=dst_folder, prefix=f".{dst_name}.", suffix=".reflink")
+    except OSError as e:
+        _logger.debug(f"Reflink not possible for [{src_file}]: {str(e)}")
+        return False
+
+    try:
+        with os.fdopen(fd, 'wb') as dst_fh, open(src_file, 'rb') as src_fh:
+            fcntl.ioctl(dst_fh.fileno(), _ficlone, src_fh.fileno())
+        os.replace(tmp_file, dst_file)
+        return True
+    except OSError as e:
+        _logger.debug(f"Reflink not possible for [{src_file}]: {str(e)}")
+        try:
+            os.unlink(tmp_file)
+        except OSError:
+            pass
+        return False
+
+
+def _try_hardlink(src_file, dst_file):
+    try:
+        if os.path.lexists(dst_file):
+            os.unlink(dst_file)
+        os.link(src_file, dst_file)
+        return True
+    except OSError as e:
+        _logger.debug(f"Hardlink not possible for [{src_file}]: {str(e)}")
+        return False
+
+
+def _copy_using_rsync(src_file, dst_file):
+    cmd = [
+        "rsync",
+        "-a", "--info=progress2", "--human-readable",
+        "--partial", "--append-verify", "--stats",
+        "--xattrs", "--acls",
+        src_file, dst_file,
+    ]
+    with subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    ) as p:
+        for line in p.stdout:
+            _logger.debug(line.rstrip())
+
+        exit_code = p.wait()
+        success = exit_code == 0
+
+        _logger.debug(f"rsync exit code: {exit_code} / Success: {success}")
+        if not success:
+            raise Exception("Failed to copy file using rsync")
+
+
+def _copy_and_hash(src_file, dst_file):
+    """Stream the source into the destination, hashing each chunk on the way through."""
+    hasher = hashlib.sha256()
+    buffer = bytearray(_copy_buffer_size)
+    view = memoryview(buffer)
+
+    with open(src_file, 'rb') as src_fh, open(dst_file, 'wb') as dst_fh:
+        while True:
+            read = src_fh.readinto(buffer)
+            if not read:
+                break
+
+            chunk = view[:read]
+            hasher.update(chunk)
+            dst_fh.write(chunk)
+
+        # Make sure the bytes are on the disk, so a read-back during verification
+        # really reads the destination instead of our own dirty pages.
+        dst_fh.flush()
+        os.fsync(dst_fh.fileno())
+
+    return hasher.hexdigest()
+
+
+def _kernel_copy(src_file, dst_file):
+    """Let the kernel move the bytes, one chunk at a time."""
+    with open(src_file, 'rb') as src_fh, open(dst_file, 'wb') as dst_fh:
+        src_fd = src_fh.fileno()
+        dst_fd = dst_fh.fileno()
+        size = os.fstat(src_fd).st_size
+        offset = 0
+
+        while offset < size:
+            count = min(_copy_buffer_size, size - offset)
+            copied = _kernel_copy_function(src_fd, dst_fd, count, offset)
+            if copied == 0:
+                raise OSError(f"Unexpected end of file at offset {offset} of {size}")
+
+            offset += copied
+
+        os.fsync(dst_fd)
+
+
+def _copy_file_range(src_fd, dst_fd, count, offset):
+    return os.copy_file_range(src_fd, dst_fd, count, offset, offset)
+
+
+def _sendfile(src_fd, dst_fd, count, offset):
+    # The destination's file position moves forward with every call.
+    return os.sendfile(dst_fd, src_fd, offset, count)
+
+
+if hasattr(os, "copy_file_range"):
+    _kernel_copy_function, _kernel_copy_strategy = _copy_file_range, "copy_file_range"
+elif hasattr(os, "sendfile") and os.name == "posix":
+    _kernel_copy_function, _kernel_copy_strategy = _sendfile, "sendfile"
+else:
+    _kernel_copy_function, _kernel_copy_strategy = None, None
 
 
 @_logger.trace("_change_destination_ownership")
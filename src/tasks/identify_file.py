@@ -1,24 +1,46 @@
 import os
 
-import requests
 from opentelemetry import trace
 
-from src.utils import get_otel_log_handler
+from src.data.identification_cache_repository import IdentificationCacheRepository, normalize_release_name
+from src.data.media_identifier_client import media_identifier_client
+from src.utils import get_otel_log_handler, to_bool_env, to_int
 
-_url = os.environ.get('API_URL')
 _logger = get_otel_log_handler("Identify File", unique_handler_types=True)
+_cache_enabled = to_bool_env("IDENTIFY_CACHE_ENABLED", True)
+_identification_cache = IdentificationCacheRepository() if _cache_enabled else None
+_bulk_enabled = to_bool_env("IDENTIFY_BULK_ENABLED", True)
+_bulk_chunk_size = max(1, to_int(os.environ.get("IDENTIFY_BULK_CHUNK_SIZE"), 25))
 
 
 @_logger.trace("identify_file")
 def identify_file(full_path: str):
     span = trace.get_current_span()
+    cache_key = normalize_release_name(full_path)
+    use_cache = _identification_cache is not None and cache_key != ""
+
     if span.is_recording():
         span.set_attributes({
             "file.path": full_path,
-            "http.url": _url,
+            "http.url": media_identifier_client.base_url,
+            "cache.key": cache_key,
         })
 
-    response = requests.get(_url, params={'it': full_path})
+    if use_cache:
+        try:
+            found, media_info = _identification_cache.get(cache_key)
+        except RuntimeError as e:
+            _logger.warning(f"Identification cache unavailable, calling the API for [{full_path}]: {str(e)}")
+            found, media_info = False, None
+
+        if span.is_recording():
+            span.set_attribute("cache.hit", found)
+
+        if found:
+            _logger.debug(f"Identification cache hit for: {full_path} (key: {cache_key})")
+            return media_info
+
+    response = media_identifier_client.get(params={'it': full_path})
 
     if span.is_recording():
         span.set_attribute("http.status_code", response.status_code)
@@ -27,14 +49,89 @@ def identify_file(full_path: str):
         _logger.debug(
             f"Success identify request, but no useful data returned for: {full_path}"
         )
+        if use_cache:
+            _store_in_cache(cache_key, None)
         return None
 
     if response.ok:
         _logger.debug(f"Identify request successful for: {full_path}")
-        return response.json()
+        media_info = response.json()
+        if use_cache and isinstance(media_info, dict):
+            _store_in_cache(cache_key, media_info)
+        return media_info
 
+    # Errors are not cached: the next attempt should reach the API again.
     _logger.error(
         f"Identify request failed ({response.status_code}) for [{full_path}] "
         f"with error: {response.text}"
     )
     return None
+
+
+@_logger.trace("prefetch_identifications")
+def prefetch_identifications(full_paths) -> int:
+    """
+    Identify many paths with bulk requests, and keep the results in the identification cache.
+
+    identify_file then finds them in memory. Paths already cached are skipped, and each one is
+    sent once, even if it shows up several times.
+    When the server doesn't support bulk requests, nothing is prefetched and identify_file
+    falls back to one call per path. Returns how many paths were prefetched.
+    """
+    span = trace.get_current_span()
+    if _identification_cache is None or not _bulk_enabled:
+        return 0
+
+    paths_by_key = {}
+    for full_path in full_paths:
+        cache_key = normalize_release_name(full_path)
+        if cache_key == "" or cache_key in paths_by_key:
+            continue
+
+        try:
+            found, _ = _identification_cache.get(cache_key)
+        except RuntimeError as e:
+            _logger.warning(f"Identification cache unavailable, not prefetching: {str(e)}")
+            return 0
+
+        if not found:
+            paths_by_key[cache_key] = full_path
+
+    missing_paths = list(paths_by_key.values())
+    prefetched = 0
+    for start in range(0, len(missing_paths), _bulk_chunk_size):
+        chunk = missing_paths[start:start + _bulk_chunk_size]
+        results = media_identifier_client.identify_many(chunk)
+        if results is None:
+            break
+
+        for full_path, media_info in results.items():
+            _store_in_cache(normalize_release_name(full_path), media_info)
+            prefetched += 1
+
+    if span.is_recording():
+        span.set_attributes({
+            "identify.paths": len(full_paths),
+            "identify.releases_to_fetch": len(missing_paths),
+            "identify.releases_prefetched": prefetched,
+        })
+
+    _logger.debug(f"Prefetched {prefetched} of {len(missing_paths)} uncached files, out of {len(full_paths)} paths.")
+    return prefetched
+
+
+def invalidate_identification(full_path: str = None) -> int:
+    """Forget the cached identification for this file, or for everything."""
+    if _identification_cache is None:
+        return 0
+
+    cache_key = None if full_path is None else normalize_release_name(full_path)
+    return _identification_cache.invalidate(cache_key)
+
+
+def _store_in_cache(cache_key, media_info):
+    try:
+        _identification_cache.put(cache_key, media_info)
+    except RuntimeError as e:
+        _logger.warning(f"Could not store the identification of [{cache_key}] in the cache: {str(e)}")
+
@@ -0,0 +1,136 @@
+import os
+import stat
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from src.utils import to_int
+
+ARCHIVE_KINDS = frozenset(("zip", "rar", "7z", "gzip", "xz", "bzip2", "compress", "lzip"))
+VIDEO_KINDS = frozenset(("matroska", "mp4", "avi"))
+IMAGE_KINDS = frozenset(("jpeg", "png", "gif", "bmp", "tiff", "webp", "heif", "avif", "ico"))
+
+# Every signature below is within the first bytes of the file.
+_head_size = 512
+# End of central directory record (22 bytes) plus the longest ZIP comment, like zipfile.is_zipfile.
+_zip_tail_size = 22 + 65535
+
+_signatures = (
+    (b'PK\x03\x04', "zip"),
+    (b'PK\x05\x06', "zip"),  # empty archive
+    (b'PK\x07\x08', "zip"),  # spanned archive
+    (b'Rar!\x1a\x07\x00', "rar"),
+    (b'Rar!\x1a\x07\x01\x00', "rar"),
+    (b'7z\xbc\xaf\x27\x1c', "7z"),
+    (b'\x1f\x8b', "gzip"),
+    (b'\xfd7zXZ\x00', "xz"),
+    (b'BZh', "bzip2"),
+    (b'\x1f\x9d', "compress"),
+    (b'LZIP', "lzip"),
+    (b'\x1a\x45\xdf\xa3', "matroska"),  # EBML header: .mkv, .webm
+    (b'\xff\xd8\xff', "jpeg"),
+    (b'\x89PNG\r\n\x1a\n', "png"),
+    (b'GIF87a', "gif"),
+    (b'GIF89a', "gif"),
+    (b'BM', "bmp"),
+    (b'II*\x00', "tiff"),
+    (b'MM\x00*', "tiff"),
+    (b'\x00\x00\x01\x00', "ico"),
+)
+_riff_kinds = {b'AVI ': "avi", b'WEBP': "webp"}
+_image_brands = {
+    b'heic': "heif", b'heix': "heif", b'hevc': "heif", b'hevx': "heif", b'mif1': "heif", b'msf1': "heif",
+    b'avif': "avif", b'avis': "avif",
+}
+
+
+def detect_kind(head: bytes) -> Optional[str]:
+    """Kind of file (e.g.: "zip", "matroska", "jpeg") from its first bytes, or None if unknown."""
+    # ISO base media (mp4, mov, m4v, heif, avif): box size, then "ftyp" and the major brand.
+    if head[4:8] == b'ftyp':
+        return _image_brands.get(head[8:12], "mp4")
+
+    if head[:4] == b'RIFF':
+        return _riff_kinds.get(head[8:12])
+
+    for signature, kind in _signatures:
+        if head.startswith(signature):
+            return kind
+
+    return None
+
+
+class FileHeaderSniffer:
+    """
+    Tells what a file is from its content, reading the file once: a small block from the start
+    and, only when that block doesn't say, a block from the end (ZIP archives with something in
+    front, e.g. self-extracting ones, are only recognised by their end of central directory).
+
+    Results are kept per (device, inode, size, modification time), so checking the same file
+    again costs a stat, and a file that was written to since is read again.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self._max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def sniff(self, path) -> Optional[str]:
+        """Kind of the file (see detect_kind), or None if it is unknown, or isn't a readable regular file."""
+        try:
+            file_stat = os.stat(path)
+        except OSError:
+            return None
+
+        if not stat.S_ISREG(file_stat.st_mode):
+            return None
+
+        key = (file_stat.st_dev, file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        try:
+            kind = self._read_kind(path, file_stat.st_size)
+        except OSError:
+            # Not cached: it may be readable next time.
+            return None
+
+        with self._lock:
+            self._entries[key] = kind
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+        return kind
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @staticmethod
+    def _read_kind(path, size: int) -> Optional[str]:
+        with open(path, "rb") as f:
+            head = f.read(_head_size)
+            kind = detect_kind(head)
+            if kind is not None:
+                return kind
+
+            if size <= len(head):
+                tail = head
+            else:
+                tail_size = min(size, _zip_tail_size)
+                f.seek(size - tail_size)
+                tail = f.read(tail_size)
+
+        return "zip" if b'PK\x05\x06' in tail else None
+
+
+header_sniffer = FileHeaderSniffer(
+    max_entries=max(1, to_int(os.environ.get("FILE_SNIFF_CACHE_MAX_ENTRIES"), 10000))
+)
+
+
+def sniff_file(path) -> Optional[str]:
+    return header_sniffer.sniff(path)
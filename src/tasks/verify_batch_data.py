@@ -1,11 +1,32 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from itertools import zip_longest
 from pathlib import Path
 
 from opentelemetry import trace
 
 from src.data.activity_logger import ActivityTracker
-from src.utils import _sha256
+from src.utils import _sha256, to_bool_env, to_int
 
 _activity_logger = ActivityTracker("Verify Batch Data")
+_mib = 1024 * 1024
+
+
+class _HashProgress:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bytes = 0
+
+    def add(self, count):
+        with self._lock:
+            self._bytes += count
+
+    @property
+    def bytes_hashed(self):
+        with self._lock:
+            return self._bytes
 
 
 @_activity_logger.trace("verify_batch_data")
@@ -34,8 +55,10 @@ def verify_batch_data(batch_id, batch_data):
     )
 
     all_ok = True
+    destination_readback = to_bool_env("VERIFY_DESTINATION_READBACK", True)
 
     verification_result = {}
+    hash_jobs = []
     for item in done_items:
         source_file = item.get("full_path")
         destination_path = item.get("target_path")
@@ -71,8 +94,10 @@ def verify_batch_data(batch_id, batch_data):
             all_ok = False
             continue
 
-        src_size = src_path.stat().st_size
-        dst_size = dst_path.stat().st_size
+        src_stat = src_path.stat()
+        dst_stat = dst_path.stat()
+        src_size = src_stat.st_size
+        dst_size = dst_stat.st_size
 
         if src_size != dst_size:
             _activity_logger.error(
@@ -84,13 +109,49 @@ def verify_batch_data(batch_id, batch_data):
             verification_result[filename] = {"size": False, "hash": None}
             continue
 
-        try:
-            src_hash = _sha256(src_path)
-            dst_hash = _sha256(dst_path)
-        except Exception as exc:
+        if src_path.samefile(dst_path):
+            # Hardlinked: both paths are the same file, nothing to compare.
+            verification_result[filename] = {"size": True, "hash": True}
+            continue
+
+        stored_src_hash = item.get("source_sha256")
+
+        if stored_src_hash is not None and not destination_readback:
+            # The hash was computed while copying, and we were told to trust it.
+            _activity_logger.debug(
+                f"[B.ID: {batch_id}] Item [{item.get('id')}] "
+                f"size matches; skipping destination read-back ({src_path.name})"
+            )
+            verification_result[filename] = {"size": True, "hash": None}
+            continue
+
+        if stored_src_hash is not None:
+            # Reuse the hash computed during the copy, and read the destination
+            # back from the disk (not from the page cache) to compare.
+            hash_jobs.append((item, "dst", dst_path, True, dst_stat.st_dev))
+        else:
+            hash_jobs.append((item, "src", src_path, False, src_stat.st_dev))
+            hash_jobs.append((item, "dst", dst_path, False, dst_stat.st_dev))
+
+    hashes = _compute_hashes(batch_id, hash_jobs)
+
+    for item in done_items:
+        item_hashes = hashes.get(item["id"])
+        if item_hashes is None:
+            continue
+
+        filename = item.get("filename")
+        src_path = Path(item.get("full_path"))
+        dst_path = Path(item.get("target_path")).joinpath(filename)
+
+        src_hash = item_hashes.get("src", item.get("source_sha256"))
+        dst_hash = item_hashes.get("dst")
+        error = item_hashes.get("error")
+
+        if error is not None:
             _activity_logger.error(
                 f"[B.ID: {batch_id}] Item [{item.get('id')}] "
-                f"error computing hashes: {exc} ({src_path} -> {dst_path})"
+                f"error computing hashes: {error} ({src_path} -> {dst_path})"
             )
             all_ok = False
             continue
@@ -117,3 +178,85 @@ def verify_batch_data(batch_id, batch_data):
         )
 
     return all_ok, verification_result
+
+
+@_activity_logger.trace("_compute_hashes")
+def _compute_hashes(batch_id, hash_jobs):
+    """
+    Hash several files at the same time, with a limited number of readers per device.
+
+    Sources and destinations usually live on different disks, so reading both
+    at once roughly halves the time, while capping the readers of each device
+    (st_dev) avoids turning a single spinning disk into a seek storm.
+    hashlib releases the GIL while hashing large buffers, so threads are enough.
+
+    Returns {item id: {"src": hash, "dst": hash}}, or {"error": ...} for the items that failed.
+    """
+    span = trace.get_current_span()
+    results = {}
+    if len(hash_jobs) == 0:
+        return results
+
+    readers_per_device = max(1, to_int(os.environ.get("VERIFY_MAX_READERS_PER_DEVICE"), 2))
+    max_workers = max(1, to_int(os.environ.get("VERIFY_MAX_WORKERS"), 8))
+    progress_interval = max(1, to_int(os.environ.get("VERIFY_PROGRESS_INTERVAL_SECONDS"), 10))
+
+    jobs_by_device = {}
+    for job in hash_jobs:
+        jobs_by_device.setdefault(job[4], []).append(job)
+
+    device_slots = {
+        device: threading.BoundedSemaphore(readers_per_device)
+        for device in jobs_by_device
+    }
+    workers = min(max_workers, readers_per_device * len(jobs_by_device))
+    progress = _HashProgress()
+
+    def hash_file(device, path, bypass_page_cache):
+        with device_slots[device]:
+            return _sha256(path, bypass_page_cache=bypass_page_cache, progress=progress.add)
+
+    # Interleave the devices, so the workers don't all queue up behind the same disk.
+    ordered_jobs = []
+    for round_of_jobs in zip_longest(*jobs_by_device.values()):
+        ordered_jobs.extend(job for job in round_of_jobs if job is not None)
+
+    _activity_logger.debug(
+        f"[B.ID: {batch_id}] Hashing {len(ordered_jobs)} files on {len(jobs_by_device)} devices "
+        f"with {workers} workers (max {readers_per_device} per device)."
+    )
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="smo-verify") as executor:
+        futures = {
+            executor.submit(hash_file, device, path, bypass_page_cache): (item, side)
+            for item, side, path, bypass_page_cache, device in ordered_jobs
+        }
+
+        pending = set(futures)
+        while len(pending) > 0:
+            _, pending = wait(pending, timeout=progress_interval)
+            elapsed = max(time.monotonic() - start, 1e-9)
+            bytes_hashed = progress.bytes_hashed
+            _activity_logger.info(
+                f"[B.ID: {batch_id}] Verification progress: {len(futures) - len(pending)}/{len(futures)} files, "
+                f"{bytes_hashed / _mib:.1f} MiB at {bytes_hashed / _mib / elapsed:.1f} MiB/s"
+            )
+
+    for future, (item, side) in futures.items():
+        item_result = results.setdefault(item["id"], {})
+        try:
+            item_result[side] = future.result()
+        except Exception as exc:
+            item_result["error"] = exc
+
+    elapsed = max(time.monotonic() - start, 1e-9)
+    if span.is_recording():
+        span.set_attributes({
+            "verify.files_hashed": len(futures),
+            "verify.devices": len(jobs_by_device),
+            "verify.bytes_hashed": progress.bytes_hashed,
+            "verify.bytes_per_second": int(progress.bytes_hashed / elapsed),
+        })
+
+    return results
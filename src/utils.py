@@ -3,8 +3,10 @@ import gc
 import hashlib
 import logging
 import os
+import threading
+from bisect import bisect_left
 from pathlib import Path
-from typing import Optional, Union
+from typing import Callable, Optional, Tuple, Union
 
 from simple_log_factory_ext_otel import otel_log_factory, TracedLogger, instrument_requests
 
@@ -47,13 +49,117 @@ def to_bool_env(name: str, default: bool) -> bool:
     return raw.strip().lower() in {"1", "true", "yes", "on"}
 
 
-def _sha256(path: Path) -> str:
+def get_file_fingerprint(path: Union[str, Path]) -> Tuple[Optional[int], Optional[int]]:
+    """Size and modification time (ns) of the file: cheap to get, and they change when the content is replaced.
+    (None, None) if the file can't be read."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None, None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _sha256(path: Path, bypass_page_cache: bool = False, progress: Optional[Callable[[int], None]] = None) -> str:
     hasher = hashlib.sha256()
     with path.open('rb') as fh:
+        if bypass_page_cache:
+            _drop_page_cache(fh.fileno())
+
         for chunk in iter(lambda: fh.read(1024 * 1024), b''):
             hasher.update(chunk)
+            if progress is not None:
+                progress(len(chunk))
     return hasher.hexdigest()
 
+
+def _drop_page_cache(fd: int) -> None:
+    """Ask the kernel to evict the file's clean pages, so the next read comes from the disk.
+
+    Pages that were not written back yet are kept, so callers that need a real
+    read-back should fsync the file after writing it. No-op where unsupported.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    except OSError as e:
+        _log.debug("posix_fadvise(DONTNEED) failed: %s", e)
+
+
+class LatencyHistogram:
+    """
+    Thread-safe latency histogram with fixed buckets (in milliseconds).
+
+    Small enough to keep one per client or pool, and to put its snapshot
+    in span attributes. Percentiles are the upper bound of the bucket they fall in
+    (never above the slowest observation).
+    """
+
+    default_buckets_ms = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+    def __init__(self, name: str, buckets_ms: tuple = default_buckets_ms):
+        self.name = name
+        self._buckets_ms = tuple(buckets_ms)
+        self._counts = [0] * (len(self._buckets_ms) + 1)
+        self._count = 0
+        self._sum_ms = 0.0
+        self._max_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, elapsed_seconds: float) -> None:
+        elapsed_ms = elapsed_seconds * 1000
+        with self._lock:
+            self._counts[bisect_left(self._buckets_ms, elapsed_ms)] += 1
+            self._count += 1
+            self._sum_ms += elapsed_ms
+            if elapsed_ms > self._max_ms:
+                self._max_ms = elapsed_ms
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        with self._lock:
+            return self._percentile(fraction)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "count": self._count,
+                "avg_ms": round(self._sum_ms / self._count, 3) if self._count > 0 else None,
+                "max_ms": round(self._max_ms, 3),
+                "p50_ms": self._percentile(0.5),
+                "p95_ms": self._percentile(0.95),
+                "p99_ms": self._percentile(0.99),
+                "buckets": {
+                    (f"le_{bound}" if index < len(self._buckets_ms) else "inf"): count
+                    for index, (bound, count) in enumerate(zip(self._buckets_ms + (None,), self._counts))
+                },
+            }
+
+    def span_attributes(self, prefix: str) -> dict:
+        """The summary values, ready for span.set_attributes (which doesn't take None or dicts)."""
+        snapshot = self.snapshot()
+        return {
+            f"{prefix}.{key}": value
+            for key, value in snapshot.items()
+            if key != "buckets" and value is not None
+        }
+
+    def _percentile(self, fraction: float) -> Optional[float]:
+        if self._count == 0:
+            return None
+
+        target = fraction * self._count
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= target:
+                if index < len(self._buckets_ms):
+                    return round(min(float(self._buckets_ms[index]), self._max_ms), 3)
+                break
+
+        return round(self._max_ms, 3)
+
+
 def get_otel_log_handler(log_name: str, **kwargs) -> TracedLogger:
     cached = _all_loggers.get(log_name)
     if cached is not None: